@@ -0,0 +1,301 @@
+"""
+Load-test the API at fixed concurrency, and write a JSON report which can be diffed
+
+Usage: python -m benchmarks.load [--concurrency 8] [--requests 500] [--report out.json]
+    [--compare baseline.json] [--seed-solutions 100000] [--scenario get_solution ...]
+
+Each scenario sends `--requests` requests through the whole application (in-process,
+over ASGI), from `--concurrency` concurrent clients, against the database configured
+in `DATABASE_URL`. For each one the report has throughput, p50 / p95 / p99 latency in
+milliseconds, errors, and the SQL statements and rows per request. Response caches are
+disabled unless `--cache` is given. Pass `--seed-solutions` (and any of the generator
+options of `benchmarks.seed`) to reset and seed the database first: **use a scratch
+database**. `add_solution` leaves the solutions it creates behind.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import httpx
+from sqlalchemy import event, text
+
+from benchmarks.seed import EXTENT, TARGETS, seed
+from nbsapi.cache import solution_caches
+from nbsapi.database import sessionmanager
+from nbsapi.main import app
+
+# the metrics compared by --compare, and whether higher is better
+COMPARED = {
+    "throughput": True,
+    "p50": False,
+    "p95": False,
+    "p99": False,
+    "statements_per_request": False,
+    "rows_per_request": False,
+}
+# a bbox of roughly 400 m x 450 m
+BBOX_WIDTH, BBOX_HEIGHT = 0.005, 0.004
+
+
+@dataclass
+class Dataset:
+    """What's in the database, for generating requests which hit it"""
+
+    ids: List[int]
+    targets: List[str]
+    extent: tuple
+
+    @classmethod
+    async def load(cls):
+        async with sessionmanager.connect() as conn:
+            ids = (
+                await conn.execute(
+                    text(
+                        "SELECT id FROM naturebasedsolution ORDER BY random() LIMIT 10000"
+                    )
+                )
+            ).scalars()
+            targets = (
+                await conn.execute(text("SELECT target FROM adaptationtarget"))
+            ).scalars()
+            return cls(list(ids), list(targets) or TARGETS, EXTENT)
+
+
+def get_solution(rng, dataset, n):
+    return "GET", f"/api/solutions/solutions/{rng.choice(dataset.ids)}", None
+
+
+def target_search(rng, dataset, n):
+    targets = [
+        {"adaptation": {"type": target}, "value": rng.randint(0, 60)}
+        for target in rng.sample(dataset.targets, rng.randint(1, 3))
+    ]
+    return "POST", "/api/solutions/solutions", {"targets": targets, "limit": 100}
+
+
+def bbox_search(rng, dataset, n):
+    west, south, east, north = dataset.extent
+    x = rng.uniform(west, east - BBOX_WIDTH)
+    y = rng.uniform(south, north - BBOX_HEIGHT)
+    return (
+        "POST",
+        "/api/solutions/solutions",
+        {"bbox": [x, y, x + BBOX_WIDTH, y + BBOX_HEIGHT]},
+    )
+
+
+def add_solution(rng, dataset, n):
+    name = f"Load test solution {uuid.uuid4().hex}"
+    solution = {
+        "name": name,
+        "definition": name,
+        "cobenefits": "Load test",
+        "specificdetails": "Load test",
+        "location": "Load test",
+        "adaptations": [
+            {"adaptation": {"type": target}, "value": rng.randint(0, 100)}
+            for target in rng.sample(dataset.targets, min(2, len(dataset.targets)))
+        ],
+    }
+    return "POST", "/api/solutions/add_solution/", solution
+
+
+SCENARIOS = {
+    "get_solution": get_solution,
+    "target_search": target_search,
+    "bbox_search": bbox_search,
+    "add_solution": add_solution,
+}
+
+
+class StatementCounter:
+    """Count the SQL statements run by the application, and the rows they return"""
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+
+    def __enter__(self):
+        event.listen(sessionmanager._engine.sync_engine, "after_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(sessionmanager._engine.sync_engine, "after_cursor_execute", self)
+
+    def __call__(self, conn, cursor, statement, parameters, context, many):
+        self.statements += 1
+        self.rows += max(cursor.rowcount, 0)
+
+
+async def run_scenario(client, scenario, dataset, n_requests, concurrency, seed):
+    rng = random.Random(seed)
+    requests = [scenario(rng, dataset, n) for n in range(n_requests)]
+    queue = iter(requests)
+    timings, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        for method, path, body in queue:
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    with StatementCounter() as counter:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    percentiles = statistics.quantiles(timings, n=100)
+    return {
+        "requests": n_requests,
+        "errors": errors,
+        "throughput": n_requests / elapsed,
+        "p50": percentiles[49],
+        "p95": percentiles[94],
+        "p99": percentiles[98],
+        "statements_per_request": counter.statements / n_requests,
+        "rows_per_request": counter.rows / n_requests,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    header = f"{'scenario':<14} {'req/s':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'stmts':>6} {'rows':>8} {'errors':>6}"
+    print(header)
+    for name, result in report["scenarios"].items():
+        print(
+            f"{name:<14} {result['throughput']:>9.1f} {result['p50']:>8.2f}"
+            f" {result['p95']:>8.2f} {result['p99']:>8.2f}"
+            f" {result['statements_per_request']:>6.2f} {result['rows_per_request']:>8.1f}"
+            f" {result['errors']:>6}"
+        )
+        previous = (baseline or {}).get("scenarios", {}).get(name)
+        if previous:
+            print(f"{'':<14} " + " ".join(compare(result, previous)))
+
+
+def compare(result: Dict[str, float], previous: Dict[str, float]) -> List[str]:
+    """Percentage changes from a previous result, marked + where they're better"""
+    changes = []
+    for metric, higher_is_better in COMPARED.items():
+        if not previous[metric]:
+            changes.append(f"{metric}: -")
+            continue
+        change = (result[metric] - previous[metric]) / previous[metric] * 100
+        better = change > 0 if higher_is_better else change < 0
+        changes.append(f"{metric}: {change:+.1f}%{' +' if better else ''}")
+    return changes
+
+
+def read_report(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_report(path: str, report: dict):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+async def run(args):
+    if args.seed_solutions:
+        await seed(
+            args.seed_solutions,
+            args.density,
+            reset=True,
+            extent=tuple(args.extent),
+            n_targets=args.targets,
+            size=args.size,
+        )
+    if not args.cache:
+        for cache in solution_caches:
+            cache.max_bytes = 0
+    dataset = await Dataset.load()
+    dataset.extent = tuple(args.extent)
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "concurrency": args.concurrency,
+        "cache": args.cache,
+        "solutions_sampled": len(dataset.ids),
+        "scenarios": {},
+    }
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        for name in args.scenario:
+            # warm up the target cache and the connection pool
+            await run_scenario(client, SCENARIOS[name], dataset, 10, 1, seed=-1)
+            report["scenarios"][name] = await run_scenario(
+                client,
+                SCENARIOS[name],
+                dataset,
+                args.requests,
+                args.concurrency,
+                seed=42,
+            )
+    await sessionmanager.close()
+    baseline = None
+    if args.compare:
+        baseline = await asyncio.to_thread(read_report, args.compare)
+    print_report(report, baseline)
+    if args.report:
+        await asyncio.to_thread(write_report, args.report, report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument(
+        "--scenario",
+        nargs="+",
+        choices=SCENARIOS,
+        default=list(SCENARIOS),
+        help="Scenarios to run, in order. All of them by default",
+    )
+    parser.add_argument("--report", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="A previous JSON report to compare with")
+    parser.add_argument(
+        "--cache", action="store_true", help="Leave response caches enabled"
+    )
+    parser.add_argument(
+        "--seed-solutions",
+        type=int,
+        default=0,
+        help="Reset and seed the database with this many solutions first",
+    )
+    parser.add_argument("--targets", type=int, default=len(TARGETS))
+    parser.add_argument("--density", type=float, default=0.6)
+    parser.add_argument("--size", type=float, default=0)
+    parser.add_argument(
+        "--extent", type=float, nargs=4, default=EXTENT, metavar=("W", "S", "E", "N")
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
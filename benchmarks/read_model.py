@@ -0,0 +1,99 @@
+"""
+Benchmark reads from the `nbs_document` read model against building documents per query
+
+Usage: python -m benchmarks.read_model [--iterations 200] [--page 100]
+
+Times `get_solution` for random IDs, and `get_filtered_solutions` for pages of
+`--page` solutions filtered by 1 - 3 targets, with `settings.read_model` off (documents
+are aggregated from the solution, association and target tables) and on (documents
+and target maps are read from `nbs_document`). Reports p50 / p99 latency in
+milliseconds. The read model must have been created by `alembic upgrade head`.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+from benchmarks.seed import TARGETS
+from nbsapi.config import settings
+from nbsapi.crud.naturebasedsolution import get_filtered_solutions, get_solution
+from nbsapi.database import sessionmanager
+from nbsapi.models import NatureBasedSolution as NbsDBModel
+from nbsapi.schemas.adaptationtarget import AdaptationTargetRead, TargetBase
+
+
+async def measure(read, arguments):
+    timings = []
+    async with sessionmanager.session() as session:
+        for argument in arguments:
+            start = time.perf_counter()
+            await read(session, argument)
+            timings.append((time.perf_counter() - start) * 1000)
+    percentiles = statistics.quantiles(timings, n=100)
+    return percentiles[49], percentiles[98]
+
+
+async def compare(name, read, arguments):
+    results = []
+    for read_model in (False, True):
+        settings.read_model = read_model
+        # warm up caches and the connection pool
+        await measure(read, arguments[:10])
+        results.append(await measure(read, arguments))
+    (join_p50, join_p99), (model_p50, model_p99) = results
+    print(
+        f"{name:<22} {join_p50:>9.2f} {join_p99:>9.2f} {model_p50:>10.2f} {model_p99:>10.2f}"
+    )
+
+
+async def run(iterations, page):
+    async with sessionmanager.session() as session:
+        max_id = await session.scalar(select(func.max(NbsDBModel.id)))
+    rng = random.Random(42)
+    print(
+        f"{'read':<22} {'join p50':>9} {'join p99':>9} {'model p50':>10} {'model p99':>10}"
+    )
+    ids = [rng.randint(1, max_id) for _ in range(iterations)]
+
+    async def read_solution(session, solution_id):
+        try:
+            await get_solution(session, solution_id)
+        except HTTPException as e:
+            # a gap in the IDs. Anything else fails the run
+            if e.status_code != 404:
+                raise
+
+    await compare("get_solution", read_solution, ids)
+    for n_targets in range(1, 4):
+        filters = [
+            [
+                AdaptationTargetRead(
+                    adaptation=TargetBase(type=target), value=rng.randint(0, 60)
+                )
+                for target in rng.sample(TARGETS, n_targets)
+            ]
+            for _ in range(iterations)
+        ]
+
+        async def search(session, targets):
+            await get_filtered_solutions(session, targets, None, limit=page)
+
+        await compare(f"search, {n_targets} targets", search, filters)
+    await sessionmanager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--page", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.page))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark the filtered solution search against a seeded PostGIS database
+
+Usage: python -m benchmarks.search [--iterations 200] [--seed-solutions 100000]
+
+Compares the previous search strategy (an `ST_Area` round trip to check the bbox, then
+one CTE per requested target) with the single statement built by `build_filtered_query`,
+for filters of 1 - 6 targets with and without a bbox, and reports p50 / p99 latency in
+milliseconds. Pass `--seed-solutions` to (re)seed the database first; see `benchmarks.seed`.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from geoalchemy2 import Geography
+from geoalchemy2 import functions as geo_func
+from sqlalchemy import cast, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import distinct
+
+from benchmarks.seed import EXTENT, TARGETS, seed
+from nbsapi.crud.naturebasedsolution import build_filtered_query
+from nbsapi.database import sessionmanager
+from nbsapi.models import AdaptationTarget, Association
+from nbsapi.models import NatureBasedSolution as NbsDBModel
+from nbsapi.schemas.adaptationtarget import AdaptationTargetRead, TargetBase
+
+
+async def legacy_search(session, targets, bbox):
+    """The search as it was before it was collapsed into a single statement"""
+    query = select(NbsDBModel.id)
+    if bbox:
+        envelope = geo_func.ST_MakeEnvelope(*bbox, 4326)
+        await session.execute(select(geo_func.ST_Area(cast(envelope, Geography))))
+        query = query.where(geo_func.ST_Intersects(NbsDBModel.geometry, envelope))
+    for target in targets or []:
+        assoc_alias, target_alias = aliased(Association), aliased(AdaptationTarget)
+        cte = (
+            select(distinct(assoc_alias.nbs_id).label("nbs_id"))
+            .join(target_alias, assoc_alias.target_id == target_alias.id)
+            .where(
+                (target_alias.target == target.adaptation.type)
+                & (assoc_alias.value >= target.value)
+            )
+            .cte()
+        )
+        query = query.where(NbsDBModel.id.in_(select(cte.c.nbs_id)))
+    return (await session.scalars(query)).all()
+
+
+async def single_statement_search(session, targets, bbox):
+    query = build_filtered_query(targets, bbox).with_only_columns(NbsDBModel.id)
+    return (await session.scalars(query)).all()
+
+
+def random_filter(rng, n_targets, with_bbox):
+    targets = [
+        AdaptationTargetRead(
+            adaptation=TargetBase(type=target), value=rng.randint(0, 60)
+        )
+        for target in rng.sample(TARGETS, n_targets)
+    ]
+    bbox = None
+    if with_bbox:
+        west, south, east, north = EXTENT
+        # roughly 400 m x 450 m, comfortably under the area limit
+        x, y = rng.uniform(west, east - 0.005), rng.uniform(south, north - 0.004)
+        bbox = [x, y, x + 0.005, y + 0.004]
+    return targets, bbox
+
+
+async def measure(search, filters):
+    timings = []
+    async with sessionmanager.session() as session:
+        for targets, bbox in filters:
+            start = time.perf_counter()
+            await search(session, targets, bbox)
+            timings.append((time.perf_counter() - start) * 1000)
+    percentiles = statistics.quantiles(timings, n=100)
+    return percentiles[49], percentiles[98]
+
+
+async def run(iterations, seed_solutions):
+    if seed_solutions:
+        await seed(seed_solutions, reset=True)
+    rng = random.Random(42)
+    print(
+        f"{'targets':>7} {'bbox':>5} {'legacy p50':>11} {'legacy p99':>11} {'p50':>8} {'p99':>8}"
+    )
+    for with_bbox in (False, True):
+        for n_targets in range(1, len(TARGETS) + 1):
+            filters = [
+                random_filter(rng, n_targets, with_bbox) for _ in range(iterations)
+            ]
+            # warm up caches and the connection pool
+            await measure(single_statement_search, filters[:10])
+            legacy = await measure(legacy_search, filters)
+            current = await measure(single_statement_search, filters)
+            print(
+                f"{n_targets:>7} {str(with_bbox):>5} {legacy[0]:>11.2f} {legacy[1]:>11.2f}"
+                f" {current[0]:>8.2f} {current[1]:>8.2f}"
+            )
+    await sessionmanager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument(
+        "--seed-solutions",
+        type=int,
+        default=0,
+        help="Reset and seed the database with this many solutions first",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.seed_solutions))
+
+
+if __name__ == "__main__":
+    main()
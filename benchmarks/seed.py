@@ -0,0 +1,164 @@
+"""
+Seed a PostGIS database with a synthetic catalogue of nature-based solutions
+
+Usage: python -m benchmarks.seed --solutions 100000 [--targets 6] [--density 0.6]
+    [--size 0] [--extent W S E N] --reset
+
+The database is taken from the `DATABASE_URL` setting, exactly as it is for the API, so
+point it at a scratch database: `--reset` truncates the solution and target tables.
+"""
+
+import argparse
+import asyncio
+
+from sqlalchemy import text
+
+from nbsapi.database import sessionmanager
+
+TARGETS = [
+    "Heat",
+    "Pluvial Flooding",
+    "Drought",
+    "Coastal Flooding",
+    "Fluvial Flooding",
+    "Groundwater Flooding",
+]
+# west, south, east, north: roughly Manhattan
+EXTENT = (-74.02, 40.70, -73.93, 40.88)
+METRES_PER_DEGREE = 111_320
+
+
+def target_names(n_targets):
+    """The first `n_targets` target types: the real ones, then synthetic ones"""
+    return (TARGETS + [f"Synthetic target {i}" for i in range(7, n_targets + 1)])[
+        :n_targets
+    ]
+
+
+async def seed(
+    n_solutions,
+    density=0.6,
+    seed=0.42,
+    reset=False,
+    extent=EXTENT,
+    n_targets=len(TARGETS),
+    size=0,
+):
+    """
+    Insert `n_solutions` solutions scattered across `extent`. They're points, or if
+    `size` is given, squares with sides of up to `size` metres. Each solution is
+    associated with each of `n_targets` target types with probability `density`, with a
+    uniformly distributed value between 0 and 100. The same arguments produce the same
+    catalogue
+    """
+    west, south, east, north = extent
+    async with sessionmanager.connect() as conn:
+        if reset:
+            await conn.execute(
+                text(
+                    "TRUNCATE nbs_target_assoc, naturebasedsolution, adaptationtarget "
+                    "RESTART IDENTITY CASCADE"
+                )
+            )
+        await conn.execute(text("SELECT setseed(:seed)"), {"seed": seed})
+        await conn.execute(
+            text(
+                "INSERT INTO adaptationtarget (target) VALUES (:target) "
+                "ON CONFLICT (target) DO NOTHING"
+            ),
+            [{"target": target} for target in target_names(n_targets)],
+        )
+        await conn.execute(
+            text(
+                """
+                INSERT INTO naturebasedsolution
+                    (name, definition, cobenefits, specificdetails, location, geometry)
+                SELECT
+                    'Synthetic solution ' || g,
+                    'Synthetic definition ' || g,
+                    'Synthetic co-benefits',
+                    'Synthetic details',
+                    'Synthetic location',
+                    CASE WHEN :half_side = 0 THEN ST_SetSRID(ST_MakePoint(x, y), 4326)
+                    ELSE ST_Expand(
+                        ST_SetSRID(ST_MakePoint(x, y), 4326), random() * :half_side
+                    )
+                    END
+                FROM generate_series(1, :n) AS g,
+                LATERAL (
+                    SELECT
+                        :west + random() * (:east - :west) AS x,
+                        :south + random() * (:north - :south) AS y,
+                        g AS _
+                ) AS point
+                """
+            ),
+            {
+                "n": n_solutions,
+                "half_side": size / 2 / METRES_PER_DEGREE,
+                "west": west,
+                "south": south,
+                "east": east,
+                "north": north,
+            },
+        )
+        await conn.execute(
+            text(
+                """
+                INSERT INTO nbs_target_assoc (nbs_id, target_id, value)
+                SELECT n.id, t.id, floor(random() * 101)::int
+                FROM naturebasedsolution AS n CROSS JOIN adaptationtarget AS t
+                WHERE t.target = ANY(:targets) AND random() < :density
+                ON CONFLICT DO NOTHING
+                """
+            ),
+            {"density": density, "targets": target_names(n_targets)},
+        )
+    async with sessionmanager.connect() as conn:
+        await conn.execute(text("ANALYZE"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--solutions", type=int, default=100_000)
+    parser.add_argument(
+        "--targets", type=int, default=len(TARGETS), help="Number of target types"
+    )
+    parser.add_argument(
+        "--density",
+        type=float,
+        default=0.6,
+        help="Probability that a solution has each target",
+    )
+    parser.add_argument(
+        "--size",
+        type=float,
+        default=0,
+        help="Maximum polygon side in metres. 0 seeds points",
+    )
+    parser.add_argument(
+        "--extent", type=float, nargs=4, default=EXTENT, metavar=("W", "S", "E", "N")
+    )
+    parser.add_argument("--seed", type=float, default=0.42)
+    parser.add_argument(
+        "--reset", action="store_true", help="Truncate existing solutions and targets"
+    )
+    args = parser.parse_args()
+
+    async def run():
+        await seed(
+            args.solutions,
+            args.density,
+            args.seed,
+            args.reset,
+            tuple(args.extent),
+            args.targets,
+            args.size,
+        )
+        await sessionmanager.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark the read path: ORM hydration vs the JSON projection built in Postgres
+
+Usage: python -m benchmarks.serialisation [--solutions 1000] [--rounds 20]
+
+The ORM path loads `NatureBasedSolution` models with their targets, converts each one
+using `build_nbs_schema_from_model`, then serialises the list with pydantic, as the read
+endpoints used to. The projection path selects the documents built by
+`solution_document` and joins them into a JSON array. Both produce the response body for
+the first `--solutions` solutions; the report is in solutions per second.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from nbsapi.api.responses import json_array
+from nbsapi.crud.naturebasedsolution import (
+    build_nbs_schema_from_model,
+    get_filtered_solutions,
+)
+from nbsapi.database import sessionmanager
+from nbsapi.models import Association
+from nbsapi.models import NatureBasedSolution as NbsDBModel
+from nbsapi.schemas.naturebasedsolution import NatureBasedSolutionRead
+
+solutions_adapter = TypeAdapter(List[NatureBasedSolutionRead])
+
+
+async def orm_path(session, n_solutions):
+    models = (
+        await session.scalars(
+            select(NbsDBModel)
+            .options(joinedload(NbsDBModel.solution_targets).joinedload(Association.tg))
+            .order_by(NbsDBModel.id)
+            .limit(n_solutions)
+        )
+    ).unique()
+    solutions = [await build_nbs_schema_from_model(model) for model in models]
+    return solutions_adapter.dump_json(solutions, by_alias=True)
+
+
+async def projection_path(session, n_solutions):
+    rows = await get_filtered_solutions(session, None, None, limit=n_solutions)
+    return json_array(row.document for row in rows)
+
+
+async def measure(path, n_solutions, rounds):
+    rates = []
+    for _ in range(rounds):
+        # a fresh session each round, so the ORM path can't reuse its identity map
+        async with sessionmanager.session() as session:
+            start = time.perf_counter()
+            await path(session, n_solutions)
+            rates.append(n_solutions / (time.perf_counter() - start))
+    return statistics.median(rates)
+
+
+async def run(n_solutions, rounds):
+    # warm up the connection pool
+    await measure(projection_path, n_solutions, 1)
+    orm = await measure(orm_path, n_solutions, rounds)
+    projection = await measure(projection_path, n_solutions, rounds)
+    print(f"ORM hydration:       {orm:>10,.0f} solutions/s")
+    print(
+        f"Postgres projection: {projection:>10,.0f} solutions/s ({projection / orm:.1f}x)"
+    )
+    await sessionmanager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--solutions", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.solutions, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Add solution document read model
+
+Revision ID: b7e2d41c9a05
+Revises: 4f84df901480
+Create Date: 2026-10-18 09:12:44.501230+00:00
+
+"""
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b7e2d41c9a05"
+down_revision = "4f84df901480"
+branch_labels = None
+depends_on = None
+
+# (re)build the documents of the given solutions. The document has the same shape as
+# nbsapi.crud.naturebasedsolution.solution_document
+REFRESH_FUNCTION = """
+CREATE FUNCTION nbs_document_refresh(solution_ids integer[]) RETURNS void
+LANGUAGE sql AS $$
+    INSERT INTO nbs_document (nbs_id, targets, document)
+    SELECT
+        s.id,
+        coalesce(t.targets, '{}'::jsonb),
+        json_build_object(
+            'name', s.name,
+            'definition', s.definition,
+            'cobenefits', s.cobenefits,
+            'specificdetails', s.specificdetails,
+            'location', s.location,
+            'id', s.id,
+            'solution_targets', coalesce(t.solution_targets, '[]'::json)
+        )::text
+    FROM naturebasedsolution s
+    LEFT JOIN LATERAL (
+        SELECT
+            jsonb_object_agg(tg.target, a.value) AS targets,
+            json_agg(
+                json_build_object(
+                    'adaptation', json_build_object('id', tg.id, 'type', tg.target),
+                    'value', a.value
+                ) ORDER BY tg.id
+            ) AS solution_targets
+        FROM nbs_target_assoc a
+        JOIN adaptationtarget tg ON tg.id = a.target_id
+        WHERE a.nbs_id = s.id
+    ) t ON true
+    WHERE s.id = ANY(solution_ids)
+    ON CONFLICT (nbs_id) DO UPDATE
+        SET targets = excluded.targets, document = excluded.document
+$$
+"""
+
+# statement-level triggers, so a multi-row write refreshes each document once
+TRIGGER_FUNCTIONS = [
+    """
+    CREATE FUNCTION nbs_document_solutions_changed() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM nbs_document_refresh(ARRAY(SELECT id FROM new_rows));
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE FUNCTION nbs_document_associations_changed() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM nbs_document_refresh(ARRAY(SELECT nbs_id FROM new_rows));
+        ELSIF TG_OP = 'UPDATE' THEN
+            PERFORM nbs_document_refresh(
+                ARRAY(SELECT nbs_id FROM new_rows UNION SELECT nbs_id FROM old_rows)
+            );
+        ELSE
+            PERFORM nbs_document_refresh(ARRAY(SELECT nbs_id FROM old_rows));
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE FUNCTION nbs_document_targets_changed() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM nbs_document_refresh(
+            ARRAY(
+                SELECT DISTINCT a.nbs_id
+                FROM nbs_target_assoc a JOIN new_rows n ON n.id = a.target_id
+            )
+        );
+        RETURN NULL;
+    END
+    $$
+    """,
+]
+
+# name, table, event, transition tables, function
+TRIGGERS = [
+    (
+        "nbs_document_solutions_inserted",
+        "naturebasedsolution",
+        "INSERT",
+        "NEW TABLE AS new_rows",
+        "nbs_document_solutions_changed",
+    ),
+    (
+        "nbs_document_solutions_updated",
+        "naturebasedsolution",
+        "UPDATE",
+        "NEW TABLE AS new_rows",
+        "nbs_document_solutions_changed",
+    ),
+    (
+        "nbs_document_associations_inserted",
+        "nbs_target_assoc",
+        "INSERT",
+        "NEW TABLE AS new_rows",
+        "nbs_document_associations_changed",
+    ),
+    (
+        "nbs_document_associations_updated",
+        "nbs_target_assoc",
+        "UPDATE",
+        "NEW TABLE AS new_rows OLD TABLE AS old_rows",
+        "nbs_document_associations_changed",
+    ),
+    (
+        "nbs_document_associations_deleted",
+        "nbs_target_assoc",
+        "DELETE",
+        "OLD TABLE AS old_rows",
+        "nbs_document_associations_changed",
+    ),
+    (
+        "nbs_document_targets_updated",
+        "adaptationtarget",
+        "UPDATE",
+        "NEW TABLE AS new_rows",
+        "nbs_document_targets_changed",
+    ),
+]
+
+
+def upgrade():
+    op.create_table(
+        "nbs_document",
+        sa.Column("nbs_id", sa.Integer(), nullable=False),
+        sa.Column("targets", postgresql.JSONB(), nullable=False),
+        sa.Column("document", sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["nbs_id"], ["naturebasedsolution.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("nbs_id"),
+    )
+    op.execute(REFRESH_FUNCTION)
+    for function in TRIGGER_FUNCTIONS:
+        op.execute(function)
+    for name, table, event, transition, function in TRIGGERS:
+        op.execute(
+            f"CREATE TRIGGER {name} AFTER {event} ON {table} "
+            f"REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+        )
+    # backfill
+    op.execute("SELECT nbs_document_refresh(ARRAY(SELECT id FROM naturebasedsolution))")
+
+
+def downgrade():
+    for name, table, _, _, _ in TRIGGERS:
+        op.execute(f"DROP TRIGGER {name} ON {table}")
+    for function in (
+        "nbs_document_solutions_changed()",
+        "nbs_document_associations_changed()",
+        "nbs_document_targets_changed()",
+        "nbs_document_refresh(integer[])",
+    ):
+        op.execute(f"DROP FUNCTION {function}")
+    op.drop_table("nbs_document")
@@ -0,0 +1,65 @@
+"""Add solution full-text search
+
+Revision ID: d3f9a6c1e872
+Revises: b7e2d41c9a05
+Create Date: 2026-10-18 11:03:27.904113+00:00
+
+"""
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d3f9a6c1e872"
+down_revision = "b7e2d41c9a05"
+branch_labels = None
+depends_on = None
+
+# the same as nbsapi.models.naturebasedsolution.SEARCH_DOCUMENT
+SEARCH_DOCUMENT = """
+    setweight(to_tsvector('english', name), 'A')
+    || setweight(to_tsvector('english', definition), 'B')
+    || setweight(to_tsvector('english', cobenefits || ' ' || specificdetails), 'C')
+    || setweight(to_tsvector('english', location), 'D')
+"""
+
+# B-tree indexes on long free text, which no query uses
+TEXT_INDEXES = ["definition", "cobenefits", "specificdetails", "location"]
+
+
+def upgrade():
+    # adding a stored generated column rewrites the table
+    op.add_column(
+        "naturebasedsolution",
+        sa.Column(
+            "search",
+            postgresql.TSVECTOR(),
+            sa.Computed(SEARCH_DOCUMENT, persisted=True),
+            nullable=True,
+        ),
+    )
+    op.create_index(
+        "ix_naturebasedsolution_search",
+        "naturebasedsolution",
+        ["search"],
+        unique=False,
+        postgresql_using="gin",
+    )
+    for column in TEXT_INDEXES:
+        op.drop_index(
+            f"ix_naturebasedsolution_{column}", table_name="naturebasedsolution"
+        )
+
+
+def downgrade():
+    for column in TEXT_INDEXES:
+        op.create_index(
+            f"ix_naturebasedsolution_{column}",
+            "naturebasedsolution",
+            [column],
+            unique=False,
+        )
+    op.drop_index("ix_naturebasedsolution_search", table_name="naturebasedsolution")
+    op.drop_column("naturebasedsolution", "search")
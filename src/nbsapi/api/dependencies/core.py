@@ -1,8 +1,23 @@
-from typing import Annotated
+import secrets
+from typing import Annotated, Optional
 
-from fastapi import Depends
+from fastapi import Depends, Header, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from nbsapi.config import settings
 from nbsapi.database import get_db_session
 
 DBSessionDep = Annotated[AsyncSession, Depends(get_db_session)]
+
+
+def require_admin_token(x_admin_token: Annotated[Optional[str], Header()] = None):
+    """
+    Only allow requests with the `ADMIN_TOKEN` in an `X-Admin-Token` header. Admin
+    routes don't exist (404) if it isn't set
+    """
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token.encode(), settings.admin_token.encode()
+    ):
+        raise HTTPException(status_code=403, detail="A valid X-Admin-Token is required")
@@ -0,0 +1,57 @@
+import time
+
+from nbsapi import metrics
+
+
+class RequestContextMiddleware:
+    """
+    Make the request's ASGI scope available to everything handling it (see
+    `metrics.route_name`), so that SQL statements can be attributed to their route
+    whether or not metrics are enabled
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = metrics.current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metrics.current_scope.reset(token)
+
+
+class MetricsMiddleware:
+    """
+    Record the latency and status of every request, by method and route template. The
+    latency includes sending the response body, so streamed responses are measured
+    until they end
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = metrics.route_name(scope)
+            metrics.REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=scope["method"], route=route
+            )
+            metrics.REQUESTS.inc(method=scope["method"], route=route, status=status)
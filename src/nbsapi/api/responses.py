@@ -0,0 +1,43 @@
+from typing import Any, Iterable
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from nbsapi import metrics
+from nbsapi.cache import CachedResponse
+
+
+class RawJSONResponse(Response):
+    """
+    A response for JSON which has already been serialised, e.g. by Postgres. Its content
+    is either a single JSON document or an iterable of documents, which are sent as an
+    array. Nothing is parsed or validated on the way out
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (str, bytes)):
+            return content.encode("utf-8") if isinstance(content, str) else content
+        return json_array(content)
+
+
+def json_array(documents: Iterable[str]) -> bytes:
+    """Join serialised JSON documents into a JSON array"""
+    with metrics.phase("serialise"):
+        return ("[" + ",".join(documents) + "]").encode("utf-8")
+
+
+def conditional_response(
+    request: Request, cached: CachedResponse, media_type: str
+) -> Response:
+    """
+    Send a cached response, or an empty 304 if the client's `If-None-Match` header shows
+    that it already has it
+    """
+    headers = {**(cached.headers or {}), "ETag": cached.etag}
+    if_none_match = request.headers.get("if-none-match", "")
+    etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    if cached.etag in etags or "*" in etags:
+        return Response(status_code=304, headers=headers)
+    return Response(cached.content, media_type=media_type, headers=headers)
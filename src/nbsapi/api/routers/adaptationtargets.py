@@ -1,9 +1,12 @@
 # from nbsapi.api.dependencies.auth import validate_is_authenticated
 from typing import List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from pydantic import TypeAdapter
 
 from nbsapi.api.dependencies.core import DBSessionDep
+from nbsapi.api.responses import conditional_response
+from nbsapi.cache import response_cache
 from nbsapi.crud.adaptationtarget import get_target, get_targets
 from nbsapi.schemas.adaptationtarget import TargetBase
 
@@ -14,8 +17,23 @@ router = APIRouter(
 )
 
 
-@router.get("/target", response_model=List[TargetBase])
-async def read_targets(db_session: DBSessionDep):
-    """Retrieve all available adaptation targets"""
-    targets = await get_targets(db_session)
-    return targets
+TargetList = TypeAdapter(List[TargetBase])
+
+
+@router.get(
+    "/target",
+    response_model=List[TargetBase],
+    responses={304: {"description": "Not modified"}},
+)
+async def read_targets(request: Request, db_session: DBSessionDep):
+    """
+    Retrieve all available adaptation targets
+
+    Responses have an `ETag`: send it in an `If-None-Match` header to revalidate the list
+
+    """
+    cached = response_cache.get("targets")
+    if cached is None:
+        targets = await get_targets(db_session)
+        cached = response_cache.set("targets", TargetList.dump_json(targets))
+    return conditional_response(request, cached, "application/json")
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from nbsapi import metrics
+from nbsapi.api.dependencies.core import require_admin_token
+from nbsapi.database import sessionmanager
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """Metrics in the Prometheus text exposition format"""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.get("/admin/statements", dependencies=[Depends(require_admin_token)])
+async def read_traced_statements(limit: int = Query(default=100, ge=1, le=10_000)):
+    """
+    The most recent slow and sampled SQL statements, newest first, and the slow
+    statements grouped by fingerprint. Statements are recorded with their literals and
+    parameters replaced by `?`, and the route which issued them
+
+    Enable this by setting `SLOW_STATEMENT_MS` and / or `STATEMENT_SAMPLE_RATE`, and `ADMIN_TOKEN`.
+    Requests need the admin token in an `X-Admin-Token` header
+
+    """
+    if sessionmanager.tracer is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Statement tracing is disabled: set SLOW_STATEMENT_MS or STATEMENT_SAMPLE_RATE",
+        )
+    return sessionmanager.tracer.report(limit)
@@ -1,19 +1,41 @@
 # from nbsapi.api.dependencies.auth import validate_is_authenticated
 
-from typing import Dict, List, Optional
+import json
+from typing import Any, Dict, List, Literal, Optional, Union
 
-from fastapi import APIRouter, Body, Depends, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
 from nbsapi.api.dependencies.core import DBSessionDep
+from nbsapi.api.responses import conditional_response, json_array
+from nbsapi.cache import response_cache, tile_cache
 from nbsapi.crud.naturebasedsolution import (
+    MAX_AGGREGATE_CELLS,
+    NEAREST_DEFAULT_LIMIT,
     create_nature_based_solution,
+    get_aggregates,
     get_filtered_solutions,
+    get_nearest_solutions,
+    get_ranked_solutions,
     get_solution,
+    get_solution_tile,
+    get_solutions_by_id,
+    ingest_solutions,
+    refresh_association_index,
+    stream_filtered_solutions,
 )
+from nbsapi.export import FORMATS, export_solutions
+from nbsapi.ingest import iterate, read_ndjson
 from nbsapi.schemas.adaptationtarget import AdaptationTargetRead
 from nbsapi.schemas.naturebasedsolution import (
+    AggregateCell,
+    IdList,
+    IngestReport,
+    NatureBasedSolutionBatch,
     NatureBasedSolutionCreate,
     NatureBasedSolutionRead,
+    NearbyNatureBasedSolutionRead,
+    RankedNatureBasedSolutionRead,
 )
 
 router = APIRouter(
@@ -23,15 +45,176 @@ router = APIRouter(
 )
 
 
-@router.get("/solutions/{solution_id}", response_model=NatureBasedSolutionRead)
-async def read_nature_based_solution(solution_id: int, db_session: DBSessionDep):
-    """Retrieve a nature-based solution using its ID"""
-    solution = await get_solution(db_session, solution_id)
-    return solution
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+GEOJSON_MEDIA_TYPE = "application/geo+json"
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+MAX_TILE_ZOOM = 22
+# maximum number of solutions fetched by ID in one request
+MAX_BATCH_IDS = 1000
+# solution IDs are Postgres integers: larger ones can't be bound in a query
+MAX_SOLUTION_ID = 2**31 - 1
+# maximum number of nearest solutions returned
+MAX_NEAREST = 1000
+# bbox coordinates are rounded to this many decimal places (~0.1 m), so that
+# near-identical searches share a cache entry
+BBOX_PRECISION = 6
+
+
+@router.get(
+    "/solutions/{solution_id}",
+    response_model=NatureBasedSolutionRead,
+    responses={304: {"description": "Not modified"}},
+)
+async def read_nature_based_solution(
+    solution_id: int, request: Request, db_session: DBSessionDep
+):
+    """
+    Retrieve a nature-based solution using its ID
+
+    Responses have an `ETag`: send it in an `If-None-Match` header to revalidate a solution
+
+    """
+    key = ("solution", solution_id)
+    cached = response_cache.get(key)
+    if cached is None:
+        solution = await get_solution(db_session, solution_id)
+        cached = response_cache.set(key, solution.encode("utf-8"))
+    return conditional_response(request, cached, JSON_MEDIA_TYPE)
+
+
+async def batch_response(request: Request, db_session, solution_ids: List[int]):
+    if not solution_ids:
+        raise HTTPException(status_code=400, detail="No solution IDs were given")
+    if len(solution_ids) > MAX_BATCH_IDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_IDS} solutions can be fetched at once",
+        )
+    if not all(-MAX_SOLUTION_ID - 1 <= i <= MAX_SOLUTION_ID for i in solution_ids):
+        raise HTTPException(
+            status_code=400, detail="Solution IDs must be 32-bit integers"
+        )
+    key = ("solutions", tuple(solution_ids))
+    cached = response_cache.get(key)
+    if cached is None:
+        documents, missing = await get_solutions_by_id(db_session, solution_ids)
+        cached = response_cache.set(
+            key,
+            b'{"solutions":'
+            + json_array(documents)
+            + b',"missing":'
+            + json.dumps(missing).encode("utf-8")
+            + b"}",
+        )
+    return conditional_response(request, cached, JSON_MEDIA_TYPE)
+
+
+@router.get(
+    "/solutions",
+    response_model=NatureBasedSolutionBatch,
+    responses={304: {"description": "Not modified"}},
+)
+async def read_nature_based_solutions(
+    request: Request,
+    db_session: DBSessionDep,
+    ids: str = Query(
+        ...,
+        description=f"Comma-separated solution IDs. At most {MAX_BATCH_IDS}",
+        examples=["1,2,3"],
+    ),
+):
+    """
+    Retrieve several nature-based solutions using their IDs, in one request
+
+    Solutions are returned in the order they were requested. IDs which don't exist are listed in `missing`.
+    Responses have an `ETag`: send it in an `If-None-Match` header to revalidate them
+
+    """
+    try:
+        solution_ids = [int(solution_id) for solution_id in ids.split(",")]
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="ids must be a comma-separated list of integers"
+        )
+    return await batch_response(request, db_session, solution_ids)
+
+
+@router.post(
+    "/solutions/batch",
+    response_model=NatureBasedSolutionBatch,
+    responses={304: {"description": "Not modified"}},
+)
+async def read_nature_based_solutions_batch(
+    request: Request, db_session: DBSessionDep, body: IdList
+):
+    """
+    Retrieve several nature-based solutions using their IDs, like `GET /solutions?ids=`, for ID lists too long for a URL
+
+    """
+    return await batch_response(request, db_session, body.ids)
+
 
+def targets_key(targets):
+    """Target filters as a cache key. They're sorted, so their order doesn't matter"""
+    return tuple(
+        sorted(
+            (target.adaptation.type, target.adaptation.id or 0, target.value)
+            for target in targets or []
+        )
+    )
 
-@router.post("/solutions", response_model=List[NatureBasedSolutionRead])
+
+def search_cache_key(targets, bbox, geometry, limit, cursor, ranking=None, q=None):
+    """
+    A cache key for a search. Targets are sorted, so the same filters given in a
+    different order share an entry. Ranked searches pass their weights as `ranking`
+    """
+    return (
+        "search",
+        ranking,
+        q,
+        targets_key(targets),
+        tuple(bbox) if bbox else None,
+        json.dumps(geometry, sort_keys=True) if geometry else None,
+        limit,
+        cursor,
+    )
+
+
+async def ndjson_lines(documents):
+    async for document in documents:
+        yield document + "\n"
+
+
+async def feature_collection(features):
+    """Stream GeoJSON Features as a FeatureCollection, one at a time"""
+    yield '{"type":"FeatureCollection","features":['
+    separator = ""
+    async for feature in features:
+        yield separator + feature
+        separator = ","
+    yield "]}"
+
+
+@router.post(
+    "/solutions",
+    response_model=List[Union[RankedNatureBasedSolutionRead, NatureBasedSolutionRead]],
+    responses={
+        200: {
+            "content": {NDJSON_MEDIA_TYPE: {}, GEOJSON_MEDIA_TYPE: {}},
+            "headers": {
+                "X-Next-Cursor": {
+                    "description": "Cursor for the next page, if there are more results",
+                    "schema": {"type": "integer"},
+                }
+            },
+        },
+        304: {"description": "Not modified"},
+    },
+)
 async def get_solutions(
+    request: Request,
     db_session: DBSessionDep,
     targets: Optional[List[AdaptationTargetRead]] = Body(
         None, description="List of adaptation targets to filter by"
@@ -40,7 +223,7 @@ async def get_solutions(
         None,
         min_items=4,
         max_items=4,
-        description="Bounding box specified as [west, south, east, north]. The list should contain exactly four float values. Max 1 sq km",
+        description="Bounding box specified as [west, south, east, north]. The list should contain exactly four float values. Max 2500 sq km",
         examples=[
             [
                 -73.968,
@@ -50,17 +233,295 @@ async def get_solutions(
             ]
         ],
     ),
+    geometry: Optional[Dict[str, Any]] = Body(
+        None,
+        description="A GeoJSON Polygon or MultiPolygon geometry, in EPSG 4326. Max 2500 sq km",
+        examples=[
+            {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [-73.968, 40.781],
+                        [-73.962, 40.781],
+                        [-73.962, 40.784],
+                        [-73.968, 40.781],
+                    ]
+                ],
+            }
+        ],
+    ),
+    limit: Optional[int] = Body(
+        None,
+        ge=1,
+        description="Maximum number of solutions to return. Results are ordered by ID when paginating",
+    ),
+    cursor: Optional[int] = Body(
+        None,
+        description="Return solutions after this cursor: use the `X-Next-Cursor` header from the previous page",
+    ),
+    q: Optional[str] = Body(
+        None,
+        max_length=500,
+        description="Text to search for in the solutions' names and descriptions",
+        examples=["wetland restoration -coastal"],
+    ),
+    rank: bool = Body(
+        False,
+        description="Return the top `limit` solutions by score, rather than every match",
+    ),
+    weights: Optional[Dict[str, float]] = Body(
+        None,
+        description="Weights of the requested targets in the ranking score, by target type. Defaults to 1",
+        examples=[{"Heat": 2.0, "Pluvial Flooding": 0.5}],
+    ),
+    proximity_weight: float = Body(
+        0,
+        ge=0,
+        description="Weight of proximity to the centre of the bbox or geometry in the ranking score",
+    ),
 ):
     """
     Return a list of nature-based solutions using _optional_ filter criteria:
 
     - `targets`: An array of one or more **adaptation targets** and their associated protection values. Solutions having targets with protection values **equal to or greater than** the specified values will be returned
-    - `bbox`: An array of 4 EPSG 4326 coordinates. Only solutions intersected by the bbox will be returned. It must be **<=** 1 km sq
+    - `bbox`: An array of 4 EPSG 4326 coordinates. Only solutions intersected by the bbox will be returned. It must be **<=** 2500 km sq
+    - `geometry`: A GeoJSON Polygon or MultiPolygon. Only solutions intersected by it will be returned. It must be **<=** 2500 km sq
+    - `limit` and `cursor`: paginate the results. If there are more results, the response has an `X-Next-Cursor` header: pass its value as the `cursor` to get the next page
+    - `q`: Only solutions whose name, definition, co-benefits, details or location match this text will be returned, most relevant first. Words are matched in any form ("restore" matches "restoration"), and "quoted phrases", `OR` and `-word` to exclude a word are supported. Text searches can't be paginated with `cursor`: use `limit` to return the most relevant
+
+    - `rank`: return only the top `limit` (10 by default) solutions, ordered by a `score` which is added to each: the sum of their requested target values / 100, multiplied by the target's `weights` entry (1 by default), plus `proximity_weight` / (1 + their distance in km from the centre of the `bbox` or `geometry`), plus their relevance to `q`. Ranked searches can't be paginated with `cursor`
+
+    Send an `Accept: application/x-ndjson` header to stream the results as newline-delimited JSON instead,
+    or an `Accept: application/geo+json` header to stream them as a GeoJSON FeatureCollection, with each solution's geometry, and its fields as the Feature's properties.
+    Streamed results don't have an `X-Next-Cursor` header: paginate them using the last solution's `id` as the `cursor`. Ranked searches are always returned as a JSON array.
+    Otherwise responses have an `ETag`: send it in an `If-None-Match` header to revalidate the results
+
+    """
+    if bbox:
+        bbox = [round(coordinate, BBOX_PRECISION) for coordinate in bbox]
+    q = q.strip() if q else None
+    if q and cursor is not None:
+        raise HTTPException(
+            status_code=400,
+            detail="Text searches are ordered by relevance, and can't be paginated",
+        )
+    if rank:
+        if cursor is not None:
+            raise HTTPException(
+                status_code=400, detail="Ranked searches can't be paginated"
+            )
+        ranking = (tuple(sorted((weights or {}).items())), proximity_weight)
+        key = search_cache_key(targets, bbox, geometry, limit, None, ranking, q)
+        cached = response_cache.get(key)
+        if cached is None:
+            solutions = await get_ranked_solutions(
+                db_session,
+                targets,
+                bbox,
+                geometry,
+                weights,
+                proximity_weight,
+                limit,
+                q,
+            )
+            cached = response_cache.set(key, json_array(solutions))
+        return conditional_response(request, cached, JSON_MEDIA_TYPE)
+    accept = request.headers.get("accept", "")
+    if NDJSON_MEDIA_TYPE in accept:
+        await refresh_association_index(db_session, targets)
+        return StreamingResponse(
+            ndjson_lines(
+                stream_filtered_solutions(targets, bbox, limit, cursor, geometry, q)
+            ),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+    if GEOJSON_MEDIA_TYPE in accept:
+        await refresh_association_index(db_session, targets)
+        return StreamingResponse(
+            feature_collection(
+                stream_filtered_solutions(
+                    targets, bbox, limit, cursor, geometry, q, features=True
+                )
+            ),
+            media_type=GEOJSON_MEDIA_TYPE,
+        )
+    key = search_cache_key(targets, bbox, geometry, limit, cursor, q=q)
+    cached = response_cache.get(key)
+    if cached is None:
+        # fetch an extra solution to find out whether there's another page
+        solutions = await get_filtered_solutions(
+            db_session,
+            targets,
+            bbox,
+            limit + 1 if limit else None,
+            cursor,
+            geometry,
+            q,
+        )
+        headers = {}
+        if limit and len(solutions) > limit:
+            solutions = solutions[:limit]
+            if not q:
+                headers["X-Next-Cursor"] = str(solutions[-1].id)
+        cached = response_cache.set(
+            key, json_array(solution.document for solution in solutions), headers
+        )
+    return conditional_response(request, cached, JSON_MEDIA_TYPE)
+
+
+@router.post(
+    "/nearest",
+    response_model=List[NearbyNatureBasedSolutionRead],
+    responses={304: {"description": "Not modified"}},
+)
+async def get_nearest(
+    request: Request,
+    db_session: DBSessionDep,
+    point: List[float] = Body(
+        ...,
+        min_items=2,
+        max_items=2,
+        description="The point to search from, as [longitude, latitude] in EPSG 4326",
+        examples=[[-73.965, 40.782]],
+    ),
+    targets: Optional[List[AdaptationTargetRead]] = Body(
+        None, description="List of adaptation targets to filter by"
+    ),
+    limit: int = Body(
+        NEAREST_DEFAULT_LIMIT,
+        ge=1,
+        le=MAX_NEAREST,
+        description=f"Number of solutions to return. At most {MAX_NEAREST}",
+    ),
+    max_distance: Optional[float] = Body(
+        None, gt=0, description="Only return solutions within this many metres"
+    ),
+):
+    """
+    Return the `limit` nature-based solutions nearest to a `point`, nearest first, each with its geodesic `distance` from the point in metres.
+    Distances are measured to the nearest part of a solution's geometry, so it's 0 for solutions containing the point
+
+    - `targets`: An array of one or more **adaptation targets** and their associated protection values. Only solutions having targets with protection values **equal to or greater than** the specified values will be returned
+    - `max_distance`: Only solutions within this distance will be returned, so there may be fewer than `limit`
+
+    Responses have an `ETag`: send it in an `If-None-Match` header to revalidate the results
+
+    """
+    lon, lat = point
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise HTTPException(
+            status_code=400, detail="point must be [longitude, latitude] in EPSG 4326"
+        )
+    point = [round(coordinate, BBOX_PRECISION) for coordinate in point]
+    key = ("nearest", tuple(point), targets_key(targets), limit, max_distance)
+    cached = response_cache.get(key)
+    if cached is None:
+        solutions = await get_nearest_solutions(
+            db_session, point, targets, limit, max_distance
+        )
+        cached = response_cache.set(key, json_array(solutions))
+    return conditional_response(request, cached, JSON_MEDIA_TYPE)
+
+
+@router.post(
+    "/aggregate",
+    response_model=List[AggregateCell],
+    responses={304: {"description": "Not modified"}},
+)
+async def get_aggregate(
+    request: Request,
+    db_session: DBSessionDep,
+    bbox: List[float] = Body(
+        ...,
+        min_items=4,
+        max_items=4,
+        description="Bounding box specified as [west, south, east, north]",
+        examples=[[-74.26, 40.48, -73.7, 40.92]],
+    ),
+    grid: Literal["square", "hexagon", "kmeans"] = Body(
+        "square", description="How to group the solutions"
+    ),
+    size: Optional[float] = Body(
+        None,
+        gt=0,
+        description="Size of `square` and `hexagon` cells in metres: a square's side, or a hexagon's edge",
+        examples=[1000],
+    ),
+    clusters: Optional[int] = Body(
+        None,
+        ge=1,
+        le=MAX_AGGREGATE_CELLS,
+        description="Number of `kmeans` clusters",
+    ),
+    targets: Optional[List[AdaptationTargetRead]] = Body(
+        None, description="List of adaptation targets to filter by"
+    ),
+):
+    """
+    Summarise the nature-based solutions in a `bbox` per grid cell, rather than returning them: for a map at a low zoom level, or a dashboard.
+    Each cell which has solutions is returned with its GeoJSON `geometry`, its number of solutions, and the `mean`, `max` and `count` of each adaptation target's values.
+    Solutions are counted once, in the cell containing a point on their surface
+
+    - `grid`: `square` or `hexagon` cells of `size` metres (in EPSG 3857, so they're smaller on the ground away from the equator), anchored so that the same cells are used for every bbox. At most 10000 cells can cover the bbox.
+    Or `kmeans`, which groups the solutions into `clusters` clusters by their position. Clusters' geometries are their centroids
+    - `targets`: An array of one or more **adaptation targets** and their associated protection values. Only solutions having targets with protection values **equal to or greater than** the specified values will be counted
+
+    Responses have an `ETag`: send it in an `If-None-Match` header to revalidate the results
 
     """
-    # TODO: add optional bounding box and polygon params when we have PostGIS and geometry column
-    solutions = await get_filtered_solutions(db_session, targets, bbox)
-    return solutions
+    west, south, east, north = bbox
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise HTTPException(
+            status_code=400,
+            detail="bbox must be [west, south, east, north] in EPSG 4326",
+        )
+    if grid == "kmeans" and clusters is None:
+        raise HTTPException(status_code=400, detail="kmeans needs a number of clusters")
+    if grid != "kmeans" and size is None:
+        raise HTTPException(status_code=400, detail=f"{grid} grids need a cell size")
+    bbox = [round(coordinate, BBOX_PRECISION) for coordinate in bbox]
+    parameter = clusters if grid == "kmeans" else size
+    key = ("aggregate", tuple(bbox), grid, parameter, targets_key(targets))
+    cached = response_cache.get(key)
+    if cached is None:
+        cells = await get_aggregates(db_session, bbox, grid, size, clusters, targets)
+        cached = response_cache.set(key, json_array(cells))
+    return conditional_response(request, cached, JSON_MEDIA_TYPE)
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {media_type: {} for media_type, _ in FORMATS.values()}},
+        501: {"description": "pyarrow isn't installed"},
+    },
+)
+async def export_nature_based_solutions(
+    format: Literal["parquet", "arrow"] = Query(
+        "parquet",
+        description="`parquet` for GeoParquet, or `arrow` for an Arrow IPC stream",
+    ),
+):
+    """
+    Download every nature-based solution, with its geometry, as a GeoParquet file or an Arrow IPC stream.
+    Geometries are WKB in EPSG 4326, and each adaptation target has a column of solutions' values for it (null if they don't have it), named `target:<type>`
+
+    The export is streamed, so it can be used for catalogues of any size. FlatGeobuf isn't supported: use GeoParquet, which the same clients (GDAL, QGIS, GeoPandas) can read
+
+    """
+    try:
+        chunks = export_solutions(format)
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    media_type, extension = FORMATS[format]
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="solutions.{extension}"'
+        },
+    )
 
 
 @router.post("/add_solution/", response_model=NatureBasedSolutionRead)
@@ -74,3 +535,73 @@ async def write_nature_based_solution(
     """
     solution = await create_nature_based_solution(db_session, solution)
     return solution
+
+
+@router.get(
+    "/tiles/{z}/{x}/{y}.mvt",
+    response_class=Response,
+    responses={
+        200: {"content": {MVT_MEDIA_TYPE: {}}},
+        304: {"description": "Not modified"},
+    },
+)
+async def read_solution_tile(
+    z: int, x: int, y: int, request: Request, db_session: DBSessionDep
+):
+    """
+    Retrieve a Mapbox vector tile of nature-based solution geometries, in a `solutions` layer.
+    Features have `id` and `name` attributes, plus the values of their three highest-valued adaptation targets, named by target type
+
+    Tiles are cached, and have an `ETag`: send it in an `If-None-Match` header to revalidate a tile
+
+    """
+    if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    tile = tile_cache.get((z, x, y))
+    if tile is None:
+        tile = tile_cache.set((z, x, y), await get_solution_tile(db_session, z, x, y))
+    return conditional_response(request, tile, MVT_MEDIA_TYPE)
+
+
+@router.post(
+    "/add_solutions/",
+    response_model=IngestReport,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {
+                            "$ref": "#/components/schemas/NatureBasedSolutionCreate"
+                        },
+                    }
+                },
+                NDJSON_MEDIA_TYPE: {
+                    "schema": {"$ref": "#/components/schemas/NatureBasedSolutionCreate"}
+                },
+            },
+        }
+    },
+)
+async def bulk_write_nature_based_solutions(request: Request, db_session: DBSessionDep):
+    """
+    Add many nature-based solutions at once. The payload is a JSON array of `NatureBasedSolutionCreate` objects or, with a `Content-Type: application/x-ndjson` header, one object per line, which is streamed rather than read into memory.
+
+    Adaptation targets given by `type` are created if they don't exist. Invalid records (including ones whose name already exists, or which use an unknown target `id`) are skipped, and listed in the response by their position in the payload
+
+    """
+    if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+        records = read_ndjson(request.stream())
+    else:
+        try:
+            payload = await request.json()
+        except ValueError:
+            payload = None
+        if not isinstance(payload, list):
+            raise HTTPException(
+                status_code=422, detail="The payload must be an array of solutions"
+            )
+        records = iterate(payload)
+    return await ingest_solutions(db_session, records)
@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from nbsapi import metrics
+from nbsapi.config import settings
+from nbsapi.index import association_index
+from nbsapi.models import AdaptationTarget, Association
+from nbsapi.schemas.adaptationtarget import TargetBase
+
+
+class TargetCache:
+    """
+    A process-local copy of the adaptation target catalogue, as an id <-> name map
+
+    The catalogue is tiny and almost never changes, so it's loaded once (at startup) and
+    served from memory. Each load increments `version`. Writes to targets made in this
+    process invalidate it when they're committed; changes made by other workers are
+    picked up once the cache is older than `ttl` seconds, or when an unknown target is
+    looked up. Those lookups reload it at most once every `miss_interval` seconds, so
+    requests for nonexistent targets can't make every request reload it
+    """
+
+    def __init__(self, ttl: float, miss_interval: float):
+        self.ttl = ttl
+        self.miss_interval = miss_interval
+        self.version = 0
+        self._by_id: Dict[int, str] = {}
+        self._by_name: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    @metrics.instrumented
+    async def load(self, db_session: AsyncSession):
+        """Unconditionally (re)load the catalogue"""
+        rows = (
+            await db_session.execute(
+                select(AdaptationTarget.id, AdaptationTarget.target).order_by(
+                    AdaptationTarget.id
+                )
+            )
+        ).all()
+        self._by_id = {target_id: name for target_id, name in rows}
+        self._by_name = {name: target_id for target_id, name in rows}
+        self._loaded_at = time.monotonic()
+        self.version += 1
+
+    async def refresh(self, db_session: AsyncSession):
+        """Reload the catalogue if it's stale"""
+        if self.stale:
+            async with self._lock:
+                # another request may have reloaded it while we were waiting
+                if self.stale:
+                    await self.load(db_session)
+
+    async def reload_on_miss(self, db_session: AsyncSession):
+        """
+        Reload the catalogue after an unknown target was looked up, since another worker
+        may have added it, unless it was loaded less than `miss_interval` seconds ago
+        """
+        async with self._lock:
+            # requests which missed together wait for one reload
+            if (
+                self._loaded_at is None
+                or time.monotonic() - self._loaded_at >= self.miss_interval
+            ):
+                await self.load(db_session)
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def add(self, targets: Dict[str, int]):
+        """Add newly-committed targets, given as a name -> id map, without a reload"""
+        self._by_name.update(targets)
+        self._by_id = dict(
+            sorted({**self._by_id, **{v: k for k, v in targets.items()}}.items())
+        )
+        self.version += 1
+
+    async def targets(self, db_session: AsyncSession) -> Dict[int, str]:
+        """All targets, as an id -> name map"""
+        await self.refresh(db_session)
+        return self._by_id
+
+    async def get_name(self, db_session: AsyncSession, target_id: int) -> Optional[str]:
+        """Look up a target's name. Unknown IDs may reload the catalogue"""
+        await self.refresh(db_session)
+        if target_id not in self._by_id:
+            await self.reload_on_miss(db_session)
+        return self._by_id.get(target_id)
+
+    async def known_ids(
+        self, db_session: AsyncSession, names: Iterable[str]
+    ) -> Dict[str, int]:
+        """The IDs of those of the named targets which are in the catalogue"""
+        await self.refresh(db_session)
+        return {name: self._by_name[name] for name in names if name in self._by_name}
+
+    async def resolve(
+        self, db_session: AsyncSession, targets: Iterable[TargetBase]
+    ) -> List[Optional[int]]:
+        """
+        Resolve targets given by ID or by type to their IDs, or None if they don't exist.
+        The catalogue may be reloaded once, if any of them are unknown
+        """
+        targets = list(targets)
+        await self.refresh(db_session)
+        ids = [self._lookup(target) for target in targets]
+        if None in ids:
+            await self.reload_on_miss(db_session)
+            ids = [self._lookup(target) for target in targets]
+        return ids
+
+    def _lookup(self, target: TargetBase) -> Optional[int]:
+        if target.id is None:
+            return self._by_name.get(target.type)
+        return target.id if target.id in self._by_id else None
+
+
+class CachedResponse(NamedTuple):
+    content: bytes
+    etag: str
+    expires: float
+    headers: Optional[Dict[str, str]] = None
+
+
+class ResponseCache:
+    """
+    A bounded LRU of serialised responses, each with a strong ETag derived from its
+    content. The cache holds at most `max_bytes` of content. Entries are dropped when
+    solutions are added in this process (see `invalidate_solution_caches`), and expire
+    after `ttl` seconds so that changes made by other workers are eventually picked up
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(
+        self, key: Hashable, content: bytes, headers: Optional[Dict[str, str]] = None
+    ) -> CachedResponse:
+        etag = f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+        entry = CachedResponse(content, etag, time.monotonic() + self.ttl, headers)
+        if len(content) > self.max_bytes:
+            # too big to cache, but the caller still gets an ETag
+            return entry
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.size += len(content)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key: Hashable):
+        self.size -= len(self._entries.pop(key).content)
+
+
+target_cache = TargetCache(
+    ttl=settings.target_cache_ttl, miss_interval=settings.target_cache_miss_interval
+)
+tile_cache = ResponseCache(
+    max_bytes=settings.tile_cache_max_bytes, ttl=settings.tile_cache_ttl
+)
+response_cache = ResponseCache(
+    max_bytes=settings.response_cache_max_bytes, ttl=settings.response_cache_ttl
+)
+# caches holding anything derived from solutions or targets
+solution_caches: List[ResponseCache] = [tile_cache, response_cache]
+
+
+def invalidate_solution_caches():
+    """Call this after committing changes to solutions. Target changes call it too"""
+    for cache in solution_caches:
+        cache.clear()
+
+
+@event.listens_for(Session, "after_flush")
+def _flag_target_changes(session, flush_context):
+    if any(
+        isinstance(obj, AdaptationTarget)
+        for obj in (*session.new, *session.dirty, *session.deleted)
+    ):
+        session.info["targets_changed"] = True
+    # new associations are added to the index explicitly, but changes invalidate it
+    if any(isinstance(obj, Association) for obj in (*session.dirty, *session.deleted)):
+        session.info["associations_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_target_cache(session):
+    targets_changed = session.info.pop("targets_changed", False)
+    associations_changed = session.info.pop("associations_changed", False)
+    if association_index is not None and (targets_changed or associations_changed):
+        association_index.invalidate()
+    if targets_changed:
+        target_cache.invalidate()
+        # solution documents and tiles include target types
+        invalidate_solution_caches()
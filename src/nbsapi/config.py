@@ -7,6 +7,58 @@ class Settings(BaseSettings):
     test: bool = False
     project_name: str = "nbsapi"
     oauth_token_secret: str = "secret"
+    # seconds before the in-memory target catalogue is reloaded from the database
+    target_cache_ttl: int = 300
+    # minimum seconds between reloads of the target catalogue caused by unknown targets
+    target_cache_miss_interval: float = 5
+    # maximum area of a bbox or geometry search filter, in square kilometres
+    max_query_area: float = 2500.0
+    # decimal places of coordinates in GeoJSON responses. 6 is about 0.1 m
+    geojson_precision: int = 6
+    # vector tile cache size in bytes, and seconds before cached tiles expire
+    tile_cache_max_bytes: int = 32 * 1024 * 1024
+    tile_cache_ttl: int = 300
+    # JSON response cache size in bytes, and seconds before cached responses expire
+    response_cache_max_bytes: int = 64 * 1024 * 1024
+    response_cache_ttl: int = 60
+    # connection pool: see https://docs.sqlalchemy.org/en/20/core/pooling.html
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    # seconds to wait for a connection before giving up
+    db_pool_timeout: float = 30.0
+    # seconds after which connections are replaced
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # connections opened in the background at startup, capped at the pool size
+    db_pool_warm_up: int = 2
+    # Postgres statement_timeout in milliseconds. 0 disables it
+    db_statement_timeout: int = 0
+    # answer target filters from an in-memory numpy index (needs the `index` extra),
+    # and seconds before it's rebuilt
+    association_index: bool = False
+    association_index_ttl: int = 300
+    # read solution documents from the trigger-maintained nbs_document table, rather
+    # than building them from the solution, association and target tables
+    read_model: bool = False
+    # request, SQL and serialisation metrics at /metrics. Pool metrics are always on
+    metrics_enabled: bool = True
+    # a shared secret for the admin routes (e.g. /admin/statements), sent in an
+    # `X-Admin-Token` header. They're disabled without one
+    admin_token: str = ""
+    # log statements slower than this many milliseconds, keeping the last
+    # `statement_trace_size` at /admin/statements. 0 disables the slow statement log
+    slow_statement_ms: float = 0
+    # fraction of all statements to sample into /admin/statements
+    statement_sample_rate: float = 0.0
+    statement_trace_size: int = 1000
+    # let requests opt in to profiling by sending `profile_token`, a shared secret, in
+    # an `X-Profile` header. Nothing is profiled without one. Their SQL, plans and a
+    # cProfile breakdown are written to a log rotated at `profile_log_max_bytes`
+    profiling: bool = False
+    profile_token: str = ""
+    profile_log: str = "profile.log"
+    profile_log_max_bytes: int = 10 * 1024 * 1024
+    profile_log_backups: int = 3
     model_config = SettingsConfigDict(env_file=".env")
     # env vars will always override settings from .env
 
@@ -1,26 +1,90 @@
+from typing import Dict, Iterable
+
 from fastapi import HTTPException
-from sqlalchemy import select
+from sqlalchemy import String, any_, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from nbsapi.models.adaptation_target import AdaptationTarget
+from nbsapi import metrics
+from nbsapi.cache import invalidate_solution_caches, target_cache
+from nbsapi.models import AdaptationTarget
 from nbsapi.schemas.adaptationtarget import TargetBase
 
+# concurrent inserts of the same target can hide it from our statement's snapshot, so
+# it's looked up again
+GET_OR_CREATE_ATTEMPTS = 3
+
 
+@metrics.instrumented
 async def get_target(db_session: AsyncSession, target_id: int):
     """Retrieve an individual adaptation target"""
-    target = (
-        await db_session.scalars(
-            select(AdaptationTarget).where(AdaptationTarget.id == target_id)
-        )
-    ).first()
+    target = await target_cache.get_name(db_session, target_id)
     if not target:
         raise HTTPException(status_code=404, detail="Adaptation target not found")
-    actual = TargetBase(id=target.id, type=target.target)
+    actual = TargetBase(id=target_id, type=target)
     return actual
 
 
+@metrics.instrumented
 async def get_targets(db_session: AsyncSession):
     """Retrieve all available adaptation targets"""
-    targets = (await db_session.scalars(select(AdaptationTarget))).unique()
-    actual = [TargetBase(id=target.id, type=target.target) for target in targets]
+    targets = await target_cache.targets(db_session)
+    actual = [
+        TargetBase(id=target_id, type=target) for target_id, target in targets.items()
+    ]
     return actual
+
+
+def get_or_create_statement(names: Iterable[str]):
+    """
+    Insert any of the named targets which don't exist, and select the IDs of all of
+    them, in one statement
+    """
+    names = literal(list(names), ARRAY(String))
+    inserted = (
+        pg_insert(AdaptationTarget)
+        .from_select(["target"], select(func.unnest(names)))
+        .on_conflict_do_nothing(index_elements=[AdaptationTarget.target])
+        .returning(AdaptationTarget.target, AdaptationTarget.id)
+        .cte("inserted")
+    )
+    return select(inserted.c.target, inserted.c.id).union_all(
+        select(AdaptationTarget.target, AdaptationTarget.id).where(
+            AdaptationTarget.target == any_(names)
+        )
+    )
+
+
+@metrics.instrumented
+async def get_or_create_targets(
+    db_session: AsyncSession, names: Iterable[str]
+) -> Dict[str, int]:
+    """
+    Get the IDs of targets by name, creating any which don't exist, and commit them.
+    Known targets come from the target cache; the rest take one round trip, which is
+    safe against concurrent creation of the same targets by other workers
+    """
+    names = set(names)
+    ids = await target_cache.known_ids(db_session, names)
+    missing = names - ids.keys()
+    found = {}
+    for _ in range(GET_OR_CREATE_ATTEMPTS):
+        if not missing:
+            break
+        rows = (
+            await db_session.execute(get_or_create_statement(sorted(missing)))
+        ).all()
+        found.update(rows)
+        missing -= found.keys()
+    if missing:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Couldn't create targets: {', '.join(sorted(missing))}",
+        )
+    if found:
+        await db_session.commit()
+        target_cache.add(found)
+        # the cached target list is out of date
+        invalidate_solution_caches()
+    return {**ids, **found}
@@ -1,120 +1,993 @@
-from typing import List, Optional
+import functools
+import logging
+import math
+from typing import TYPE_CHECKING, Any, AsyncIterable, Dict, List, Optional, Tuple
 
 from fastapi import HTTPException
-from geoalchemy2 import Geography, Geometry
-from geoalchemy2 import functions as geo_func
-from geoalchemy2.elements import WKTElement
-from sqlalchemy import cast, select
+from pydantic import ValidationError
+from sqlalchemy import (
+    JSON,
+    Integer,
+    LargeBinary,
+    Text,
+    any_,
+    case,
+    cast,
+    func,
+    insert,
+    literal,
+    literal_column,
+    or_,
+    select,
+    true,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.orm import aliased, selectinload
 from sqlalchemy.sql import distinct
 
-from nbsapi.models import AdaptationTarget, Association
+from nbsapi import metrics
+from nbsapi.cache import invalidate_solution_caches, target_cache
+from nbsapi.config import settings
+from nbsapi.crud.adaptationtarget import get_or_create_targets
+from nbsapi.database import sessionmanager
+from nbsapi.index import association_index
+from nbsapi.models import AdaptationTarget, Association, SolutionDocument
 from nbsapi.models import NatureBasedSolution as NbsDBModel
+from nbsapi.models.naturebasedsolution import SEARCH_CONFIG
+from nbsapi.models.types import Geography
 from nbsapi.schemas.adaptationtarget import TargetBase
 from nbsapi.schemas.naturebasedsolution import (
     AdaptationTargetRead,
+    IngestError,
+    IngestReport,
     NatureBasedSolutionCreate,
     NatureBasedSolutionRead,
 )
 
+if TYPE_CHECKING:
+    from shapely.geometry import Polygon
+    from shapely.geometry.base import BaseGeometry
 
-async def get_intersecting_geometries(
-    db_session: AsyncSession, bbox: Optional[List[float]]
-):
-    MAX_BBOX_AREA = 1_000_000.0
-    polygon_geom = geo_func.ST_MakeEnvelope(bbox[0], bbox[1], bbox[2], bbox[3], 4326)
-    geodesic_area = (
-        await db_session.execute(geo_func.ST_Area(cast(polygon_geom, Geography)))
-    ).scalar()
-    if geodesic_area > MAX_BBOX_AREA:
+logger = logging.getLogger(__name__)
+
+# large search areas are split into cells of this size, in degrees
+SUBDIVISION_CELL_SIZE = 0.05
+# maximum number of cells a search area is split into. Areas with parts spread over a
+# larger extent are split into larger cells
+MAX_SUBDIVISION_CELLS = 4096
+# number of rows fetched from the server-side cursor at a time when streaming
+STREAM_BATCH_SIZE = 100
+# number of solutions written per transaction when bulk loading
+INGEST_CHUNK_SIZE = 1000
+# reported for records which the database rejected, whose errors are logged instead
+WRITE_FAILED = "The solution couldn't be written"
+# number of ranked results returned when no limit is given
+RANK_DEFAULT_LIMIT = 10
+# number of nearest solutions returned when no limit is given
+NEAREST_DEFAULT_LIMIT = 20
+# nearest-neighbour candidates found using the planar distance in degrees (which the
+# spatial index can order by) per result. More make the geodesic search radius they
+# bound tighter, at the cost of a longer KNN scan
+KNN_CANDIDATES = 4
+# a lower bound for the length of a degree of latitude, or of longitude at the equator
+METRES_PER_DEGREE = 110_500
+# an upper bound for the geodesic distance between two points, in metres
+HALF_MERIDIAN = 20_004_000
+# load a solution's targets in one extra statement, for `build_nbs_schema_from_model`
+WITH_TARGETS = selectinload(NbsDBModel.solution_targets).joinedload(Association.tg)
+# vector tile coordinate extent and buffer, in tile units
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+# width of the EPSG 3857 world, in metres
+WEB_MERCATOR_WIDTH = 40_075_016.68
+# number of adaptation targets included in each tile feature
+TILE_TOP_TARGETS = 3
+# aggregation grids, generated by PostGIS in EPSG 3857 (so cell sizes are in metres at
+# the equator), and the maximum number of cells or clusters in an aggregation
+AGGREGATE_GRIDS = {
+    "square": ("ST_SquareGrid", "ST_Square"),
+    "hexagon": ("ST_HexagonGrid", "ST_Hexagon"),
+}
+MAX_AGGREGATE_CELLS = 10_000
+# the latitude at which EPSG 3857 is cut off
+WEB_MERCATOR_MAX_LATITUDE = 85.051129
+
+
+@functools.cache
+def geod():
+    """The WGS84 ellipsoid. pyproj is imported on first use, to keep startup fast"""
+    from pyproj import Geod
+
+    return Geod(ellps="WGS84")
+
+
+def geodesic_area(area: "BaseGeometry") -> float:
+    """
+    Calculate the geodesic area of an EPSG 4326 geometry in square metres
+
+    This matches `ST_Area(geography)` (both use the WGS84 ellipsoid), but doesn't need a
+    round trip to the database
+    """
+    geodesic, _ = geod().geometry_area_perimeter(area)
+    return abs(geodesic)
+
+
+def bbox_area(bbox: List[float]) -> "BaseGeometry":
+    """A [west, south, east, north] bbox as a polygon"""
+    from shapely.geometry import box
+
+    return box(*bbox)
+
+
+def parse_geometry(geometry: Dict[str, Any]) -> "BaseGeometry":
+    """Validate a GeoJSON Polygon or MultiPolygon geometry"""
+    import geojson
+    from shapely.geometry import MultiPolygon, shape
+    from shapely.validation import make_valid
+
+    try:
+        parsed = geojson.GeoJSON.to_instance(geometry, strict=True)
+    except (TypeError, ValueError, AttributeError):
+        parsed = None
+    if not isinstance(parsed, (geojson.Polygon, geojson.MultiPolygon)):
+        raise HTTPException(
+            status_code=400,
+            detail="The geometry must be a GeoJSON Polygon or MultiPolygon.",
+        )
+    if not parsed.is_valid:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid GeoJSON geometry: {parsed.errors()}"
+        )
+    valid = make_valid(shape(parsed))
+    # repairing a polygon can leave lines or points behind, in a GeometryCollection
+    polygons = polygon_parts(valid)
+    if not polygons:
+        raise HTTPException(
+            status_code=400, detail="The geometry doesn't enclose any area."
+        )
+    if len(polygons) == 1:
+        return polygons[0]
+    return MultiPolygon(polygons)
+
+
+def polygon_parts(area: "BaseGeometry") -> List["Polygon"]:
+    """The polygons making up a geometry, including any in a GeometryCollection"""
+    import shapely
+    from shapely.geometry import Polygon
+
+    # collections can hold multi-part geometries, so they're flattened twice
+    parts = shapely.get_parts(shapely.get_parts(area))
+    return [part for part in parts if isinstance(part, Polygon) and not part.is_empty]
+
+
+def grid_size(extent: Tuple[float, float, float, float], cell_size: float) -> int:
+    west, south, east, north = extent
+    columns = max(math.ceil((east - west) / cell_size), 1)
+    rows = max(math.ceil((north - south) / cell_size), 1)
+    return columns * rows
+
+
+def subdivide(area: "BaseGeometry", cell_size: float = SUBDIVISION_CELL_SIZE):
+    """
+    Split each polygon of a geometry into its intersections with the cells of a regular
+    grid, anchored at its south-west corner, so anything smaller than a cell stays in
+    one piece.
+
+    Each piece is matched against the spatial index separately: the candidates for each
+    piece come from a small part of the index, and the exact intersection tests are
+    made against a simple polygon rather than the whole (possibly very complex) area.
+
+    The area limit doesn't bound a geometry's extent (e.g. a long, thin polygon, or
+    small polygons far apart), so the cell size is increased until the grids have at
+    most `MAX_SUBDIVISION_CELLS` cells, and geometries with more polygons than that
+    are rejected
+    """
+    import shapely
+    from shapely.geometry import box
+
+    polygons = polygon_parts(area)
+    if len(polygons) > MAX_SUBDIVISION_CELLS:
         raise HTTPException(
             status_code=400,
-            detail="GeoJSON input area exceeds the maximum limit of 1 square kilometer.",
+            detail=f"The geometry has more than {MAX_SUBDIVISION_CELLS} polygons.",
         )
+    extents = [polygon.bounds for polygon in polygons]
+    cells = sum(grid_size(extent, cell_size) for extent in extents)
+    while cells > MAX_SUBDIVISION_CELLS:
+        # each step at least halves the number of cells, or leaves one per polygon
+        cell_size *= max(math.sqrt(cells / MAX_SUBDIVISION_CELLS), 1.5)
+        cells = sum(grid_size(extent, cell_size) for extent in extents)
+    pieces = []
+    for polygon, (west, south, east, north) in zip(polygons, extents):
+        if grid_size((west, south, east, north), cell_size) == 1:
+            pieces.append(polygon)
+            continue
+        columns = max(math.ceil((east - west) / cell_size), 1)
+        rows = max(math.ceil((north - south) / cell_size), 1)
+        grid = [
+            box(
+                west + column * cell_size,
+                south + row * cell_size,
+                west + (column + 1) * cell_size,
+                south + (row + 1) * cell_size,
+            )
+            for column in range(columns)
+            for row in range(rows)
+        ]
+        pieces.extend(
+            piece for piece in shapely.intersection(grid, polygon) if not piece.is_empty
+        )
+    return pieces
+
 
-    # Query to find intersecting geometries
-    query = select(NbsDBModel).where(
-        geo_func.ST_Intersects(NbsDBModel.geometry, polygon_geom)
+def get_intersecting_geometries(area: "BaseGeometry"):
+    """Build a WHERE clause matching solutions intersected by an EPSG 4326 area"""
+    if geodesic_area(area) > settings.max_query_area * 1_000_000:
+        raise HTTPException(
+            status_code=400,
+            detail=f"GeoJSON input area exceeds the maximum limit of {settings.max_query_area:g} square kilometers.",
+        )
+    pieces = subdivide(area)
+    if len(pieces) == 1:
+        return func.ST_Intersects(
+            NbsDBModel.geometry, func.ST_GeomFromWKB(pieces[0].wkb, 4326)
+        )
+    cells = select(
+        func.ST_GeomFromWKB(
+            func.unnest(
+                literal([piece.wkb for piece in pieces], type_=ARRAY(LargeBinary))
+            ),
+            4326,
+        ).label("geom")
+    ).subquery()
+    candidates = aliased(NbsDBModel)
+    return NbsDBModel.id.in_(
+        select(candidates.id).join(
+            cells, func.ST_Intersects(candidates.geometry, cells.c.geom)
+        )
     )
-    return query
 
 
 async def build_nbs_schema_from_model(db_solution: NbsDBModel):
     """FastAPI seems to struggle with automatic serialisation of the the db model to the schema
     so we're doing it manually for now
     """
-    solution_read = NatureBasedSolutionRead(
-        id=db_solution.id,
-        name=db_solution.name,
-        definition=db_solution.definition,
-        cobenefits=db_solution.cobenefits,
-        specificdetails=db_solution.specificdetails,
-        location=db_solution.location,
-        adaptations=[
-            AdaptationTargetRead(
-                adaptation=TargetBase(id=assoc.tg.id, type=assoc.tg.target),
-                value=assoc.value,
+    with metrics.phase("hydrate"):
+        solution_read = NatureBasedSolutionRead(
+            id=db_solution.id,
+            name=db_solution.name,
+            definition=db_solution.definition,
+            cobenefits=db_solution.cobenefits,
+            specificdetails=db_solution.specificdetails,
+            location=db_solution.location,
+            adaptations=[
+                AdaptationTargetRead(
+                    adaptation=TargetBase(id=assoc.tg.id, type=assoc.tg.target),
+                    value=assoc.value,
+                )
+                for assoc in db_solution.solution_targets
+            ],
+        )
+    return solution_read
+
+
+def solution_document(**extra):
+    """
+    Build a solution's JSON document in Postgres, in the same shape as the serialised
+    `NatureBasedSolutionRead`. Read endpoints select this directly and send it as-is,
+    so rows never pass through the ORM or pydantic. Any `extra` expressions are added
+    to the document, e.g. ranked searches' `score`
+    """
+    target = func.json_build_object(
+        "adaptation",
+        func.json_build_object(
+            "id", AdaptationTarget.id, "type", AdaptationTarget.target
+        ),
+        "value",
+        Association.value,
+    )
+    targets = (
+        select(
+            func.coalesce(
+                func.json_agg(aggregate_order_by(target, AdaptationTarget.id)),
+                cast(literal("[]"), JSON),
             )
-            for assoc in db_solution.solution_targets
-        ],
+        )
+        .select_from(Association)
+        .join(AdaptationTarget, Association.target_id == AdaptationTarget.id)
+        .where(Association.nbs_id == NbsDBModel.id)
+        .scalar_subquery()
     )
-    return solution_read
+    return cast(
+        func.json_build_object(
+            "name",
+            NbsDBModel.name,
+            "definition",
+            NbsDBModel.definition,
+            "cobenefits",
+            NbsDBModel.cobenefits,
+            "specificdetails",
+            NbsDBModel.specificdetails,
+            "location",
+            NbsDBModel.location,
+            "id",
+            NbsDBModel.id,
+            "solution_targets",
+            targets,
+            *(item for field in extra.items() for item in field),
+        ),
+        Text,
+    ).label("document")
 
 
-async def get_solution(db_session: AsyncSession, solution_id: int):
-    solution = (
-        await db_session.scalars(
-            select(NbsDBModel)
-            .options(joinedload(NbsDBModel.solution_targets).joinedload(Association.tg))
-            .where(NbsDBModel.id == solution_id)
+def solution_feature(document):
+    """
+    Wrap a solution document as a GeoJSON Feature, with the solution's geometry built by
+    `ST_AsGeoJSON`, to `geojson_precision` decimal places, and the document as its
+    properties
+    """
+    return cast(
+        func.json_build_object(
+            "type",
+            "Feature",
+            "id",
+            NbsDBModel.id,
+            "geometry",
+            cast(
+                func.ST_AsGeoJSON(NbsDBModel.geometry, settings.geojson_precision),
+                JSON,
+            ),
+            "properties",
+            cast(document, JSON),
+        ),
+        Text,
+    )
+
+
+def select_documents(query, *columns, features: bool = False):
+    """
+    Select solution documents (after any other `columns`) from a solution query. They're
+    read from the `SolutionDocument` read model if it's enabled, and built otherwise.
+    With `features`, they're GeoJSON Features (see `solution_feature`)
+    """
+    document = SolutionDocument.document if settings.read_model else solution_document()
+    if features:
+        document = solution_feature(document)
+    query = query.with_only_columns(*columns, document.label("document"))
+    if settings.read_model:
+        return query.join_from(NbsDBModel, SolutionDocument)
+    return query
+
+
+@metrics.instrumented
+async def get_solution(db_session: AsyncSession, solution_id: int) -> str:
+    """Retrieve a solution as a serialised `NatureBasedSolutionRead`"""
+    if settings.read_model:
+        query = select(SolutionDocument.document).where(
+            SolutionDocument.nbs_id == solution_id
         )
-    ).first()
+    else:
+        query = select(solution_document()).where(NbsDBModel.id == solution_id)
+    solution = (await db_session.scalars(query)).first()
     if not solution:
         raise HTTPException(status_code=404, detail="Solution not found")
-    return await build_nbs_schema_from_model(solution)
+    return solution
+
+
+@metrics.instrumented
+async def get_solutions_by_id(
+    db_session: AsyncSession, solution_ids: List[int]
+) -> Tuple[List[str], List[int]]:
+    """
+    Retrieve solutions as serialised `NatureBasedSolutionRead`s in one statement, in the
+    order of `solution_ids` (repeats are dropped), and the IDs which don't exist
+    """
+    solution_ids = list(dict.fromkeys(solution_ids))
+    query = select_documents(
+        select(NbsDBModel).where(
+            NbsDBModel.id == any_(literal(solution_ids, ARRAY(Integer)))
+        ),
+        NbsDBModel.id,
+    )
+    documents = dict((await db_session.execute(query)).all())
+    return (
+        [
+            documents[solution_id]
+            for solution_id in solution_ids
+            if solution_id in documents
+        ],
+        [solution_id for solution_id in solution_ids if solution_id not in documents],
+    )
+
+
+def target_thresholds(targets: List[AdaptationTargetRead]) -> Dict[str, int]:
+    """Minimum values by target type. Repeated types are collapsed to their highest value"""
+    thresholds = {}
+    for target in targets:
+        target_type = target.adaptation.type
+        thresholds[target_type] = max(target.value, thresholds.get(target_type, 0))
+    return thresholds
 
 
-def build_cte(target, assoc_alias, target_alias):
+def build_target_filter(
+    targets: List[AdaptationTargetRead], weights: Optional[Dict[str, float]] = None
+):
     """
-    Build an aliased CTE for Association and AdaptationTarget
+    Select the IDs of solutions meeting every requested target threshold
+
+    This is a single grouped pass over the association table: rows matching any of the
+    (target, value) conditions are grouped by solution, and only solutions matching all
+    of them are kept. If `weights` are given, a `score` is selected too: the sum of
+    each target's value / 100, multiplied by its weight (1 by default)
     """
+    thresholds = target_thresholds(targets)
+    columns = [Association.nbs_id]
+    if weights is not None:
+        weighted = case(
+            *[
+                (
+                    AdaptationTarget.target == target_type,
+                    Association.value * weights.get(target_type, 1.0),
+                )
+                for target_type in thresholds
+            ],
+            else_=0,
+        )
+        columns.append((func.sum(weighted) / 100).label("score"))
     return (
-        select(distinct(assoc_alias.nbs_id).label("nbs_id"))
-        .join(target_alias, assoc_alias.target_id == target_alias.id)
+        select(*columns)
+        .join(AdaptationTarget, Association.target_id == AdaptationTarget.id)
         .where(
-            (target_alias.target == target.adaptation.type)
-            & (assoc_alias.value >= target.value)
+            or_(
+                *[
+                    (AdaptationTarget.target == target_type)
+                    & (Association.value >= value)
+                    for target_type, value in thresholds.items()
+                ]
+            )
         )
-        .cte()
+        .group_by(Association.nbs_id)
+        .having(func.count(distinct(Association.target_id)) == len(thresholds))
     )
 
 
-async def get_filtered_solutions(
+def text_query(q: str):
+    """
+    A tsquery for a web search style query: words, "quoted phrases", OR, and -words to
+    exclude
+    """
+    return func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), q)
+
+
+def text_rank(q: str):
+    """The relevance of a solution to a text query, using `ts_rank`"""
+    return func.ts_rank(NbsDBModel.search, text_query(q))
+
+
+def build_filtered_query(
+    targets: Optional[List[AdaptationTargetRead]],
+    bbox: Optional[List[float]],
+    geometry: Optional[Dict[str, Any]] = None,
+    q: Optional[str] = None,
+):
+    """Build the search query for the given filters. It's always a single statement"""
+    with metrics.phase("build_query"):
+        query = select(NbsDBModel)
+        if q:
+            # uses the GIN index on the generated `search` column
+            query = query.where(NbsDBModel.search.op("@@")(text_query(q)))
+        if bbox:
+            query = query.where(get_intersecting_geometries(bbox_area(bbox)))
+        if geometry:
+            query = query.where(get_intersecting_geometries(parse_geometry(geometry)))
+        if targets:
+            query = query.where(target_condition(targets))
+    return query
+
+
+def target_condition(targets: List[AdaptationTargetRead]):
+    """
+    Restrict a solution query to solutions meeting every target threshold. If the
+    association index is enabled and fresh, the matching IDs come from it, and are sent
+    as a single array parameter. Otherwise they're selected in Postgres: from the read
+    model's target maps if it's enabled, or by grouping the association table
+    """
+    if association_index is not None and not association_index.stale:
+        ids = association_index.match(target_thresholds(targets))
+        return NbsDBModel.id == any_(literal(ids.tolist(), ARRAY(Integer)))
+    if settings.read_model:
+        return NbsDBModel.id.in_(
+            select(SolutionDocument.nbs_id).where(
+                *[
+                    SolutionDocument.targets[target_type].astext.cast(Integer) >= value
+                    for target_type, value in target_thresholds(targets).items()
+                ]
+            )
+        )
+    return NbsDBModel.id.in_(build_target_filter(targets))
+
+
+def build_ranked_query(
+    targets: Optional[List[AdaptationTargetRead]],
+    bbox: Optional[List[float]],
+    geometry: Optional[Dict[str, Any]] = None,
+    weights: Optional[Dict[str, float]] = None,
+    proximity_weight: float = 0,
+    limit: Optional[int] = None,
+    q: Optional[str] = None,
+):
+    """
+    Select the documents of the `limit` highest-scoring solutions matching the filters,
+    in descending order of score. Only those rows are built and sent.
+
+    A solution's score is the sum of its requested target values / 100, multiplied by
+    their `weights` (by target type, 1 by default), plus `proximity_weight` /
+    (1 + its distance in km from the centre of the bbox or geometry), plus its
+    `ts_rank` for the text query `q`
+    """
+    weights = weights or {}
+    if not targets and not proximity_weight and not q:
+        raise HTTPException(
+            status_code=400,
+            detail="Ranking needs targets, a text query, or a proximity_weight and an area",
+        )
+    unrequested = weights.keys() - {target.adaptation.type for target in targets or []}
+    if unrequested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Weights given for targets which weren't requested: {', '.join(sorted(unrequested))}",
+        )
+    query = build_filtered_query(None, bbox, geometry, q)
+    score = literal(0.0)
+    if targets:
+        scores = build_target_filter(targets, weights).subquery()
+        query = query.join(scores, scores.c.nbs_id == NbsDBModel.id)
+        score = scores.c.score
+    if proximity_weight:
+        if not (bbox or geometry):
+            raise HTTPException(
+                status_code=400, detail="proximity_weight needs a bbox or geometry"
+            )
+        area = bbox_area(bbox) if bbox else parse_geometry(geometry)
+        distance = func.ST_Distance(
+            cast(NbsDBModel.geometry, Geography(srid=4326)),
+            cast(func.ST_GeomFromWKB(area.centroid.wkb, 4326), Geography(srid=4326)),
+        )
+        score = score + proximity_weight / (1 + distance / 1000)
+    if q:
+        score = score + text_rank(q)
+    return (
+        query.with_only_columns(solution_document(score=score))
+        .order_by(score.desc(), NbsDBModel.id)
+        .limit(limit or RANK_DEFAULT_LIMIT)
+    )
+
+
+@metrics.instrumented
+async def get_ranked_solutions(
     db_session: AsyncSession,
     targets: Optional[List[AdaptationTargetRead]],
     bbox: Optional[List[float]],
+    geometry: Optional[Dict[str, Any]] = None,
+    weights: Optional[Dict[str, float]] = None,
+    proximity_weight: float = 0,
+    limit: Optional[int] = None,
+    q: Optional[str] = None,
+) -> List[str]:
+    """The top solutions by score, as serialised documents. See `build_ranked_query`"""
+    query = build_ranked_query(
+        targets, bbox, geometry, weights, proximity_weight, limit, q
+    )
+    return (await db_session.scalars(query)).all()
+
+
+def within_radius(origin, lat: float, radius):
+    """
+    Match solutions whose bounding boxes intersect a box around an EPSG 4326 `origin`
+    (at latitude `lat`) containing everything within `radius` metres of it. The box is
+    repeated 360 degrees east and west, so it wraps around the antimeridian. `radius`
+    can be an SQL expression
+    """
+    dy = radius / METRES_PER_DEGREE
+    # degrees of longitude are shortest at the box's edge furthest from the equator
+    widest = func.cos(func.radians(func.least(abs(lat) + dy, 90)))
+    dx = func.least(dy / func.greatest(widest, 1e-9), 360)
+    area = func.ST_Expand(origin, dx, dy)
+    return or_(
+        *(
+            NbsDBModel.geometry.op("&&")(func.ST_Translate(area, offset, 0))
+            if offset
+            else NbsDBModel.geometry.op("&&")(area)
+            for offset in (0, 360, -360)
+        )
+    )
+
+
+def build_nearest_query(
+    point: List[float],
+    targets: Optional[List[AdaptationTargetRead]],
+    limit: Optional[int] = None,
+    max_distance: Optional[float] = None,
 ):
-    query = select(NbsDBModel)
-    if bbox:
-        query = await get_intersecting_geometries(db_session, bbox)
+    """
+    Select the documents of the `limit` solutions nearest to an EPSG 4326 [lon, lat]
+    `point`, with their geodesic `distance` from it in metres, nearest first.
+
+    The spatial index can only order by planar distance in degrees (`<->`), which
+    favours solutions to the north and south away from the equator. So a KNN scan finds
+    a `KNN_CANDIDATES` multiple of `limit` candidates, and the `limit`th smallest
+    geodesic distance among them is an upper bound for the true one. Every solution
+    within that distance (found using the index, with a bounding box) is then ordered
+    by geodesic distance. A `max_distance` in metres bounds both
+    """
+    limit = limit or NEAREST_DEFAULT_LIMIT
+    from shapely.geometry import Point
+
+    lon, lat = point
+    origin = func.ST_GeomFromWKB(Point(lon, lat).wkb, 4326)
+    distance = func.ST_Distance(
+        cast(NbsDBModel.geometry, Geography(srid=4326)),
+        cast(origin, Geography(srid=4326)),
+    )
+    matching = select(NbsDBModel.id).where(NbsDBModel.geometry.is_not(None))
     if targets:
-        # generate CTEs for each Target and adaptation value in the incoming API query
-        condition_sets = [
-            build_cte(target, aliased(Association), aliased(AdaptationTarget))
-            for target in targets
-        ]
+        matching = matching.where(target_condition(targets))
+    candidates = matching
+    if max_distance is not None:
+        candidates = candidates.where(within_radius(origin, lat, max_distance))
+    candidates = (
+        candidates.order_by(NbsDBModel.geometry.op("<->")(origin))
+        .limit(limit * KNN_CANDIDATES)
+        .subquery()
+    )
+    bound = (
+        select(distance)
+        .join(candidates, candidates.c.id == NbsDBModel.id)
+        .order_by(distance)
+        .offset(limit - 1)
+        .limit(1)
+        .scalar_subquery()
+    )
+    # with fewer than `limit` candidates, every matching solution is one of them
+    if max_distance is None:
+        radius = func.coalesce(bound, HALF_MERIDIAN)
+    else:
+        # LEAST ignores NULLs
+        radius = func.least(bound, max_distance)
+    radius = select(radius.label("radius")).cte("radius")
+    radius = select(radius.c.radius).scalar_subquery()
+    query = select(solution_document(distance=distance)).where(
+        NbsDBModel.id.in_(
+            matching.where(within_radius(origin, lat, radius)).scalar_subquery()
+        ),
+        distance <= radius,
+    )
+    return query.order_by(distance, NbsDBModel.id).limit(limit)
+
+
+@metrics.instrumented
+async def get_nearest_solutions(
+    db_session: AsyncSession,
+    point: List[float],
+    targets: Optional[List[AdaptationTargetRead]],
+    limit: Optional[int] = None,
+    max_distance: Optional[float] = None,
+) -> List[str]:
+    """The nearest solutions, as serialised documents. See `build_nearest_query`"""
+    await refresh_association_index(db_session, targets)
+    query = build_nearest_query(point, targets, limit, max_distance)
+    return (await db_session.scalars(query)).all()
+
+
+def web_mercator(lon: float, lat: float) -> Tuple[float, float]:
+    """Project EPSG 4326 coordinates to EPSG 3857"""
+    radius = WEB_MERCATOR_WIDTH / (2 * math.pi)
+    lat = max(min(lat, WEB_MERCATOR_MAX_LATITUDE), -WEB_MERCATOR_MAX_LATITUDE)
+    return (
+        radius * math.radians(lon),
+        radius * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)),
+    )
+
+
+def count_grid_cells(bbox: List[float], grid: str, size: float) -> int:
+    """An upper bound for the number of cells of size `size` covering a bbox"""
+    west, south = web_mercator(bbox[0], bbox[1])
+    east, north = web_mercator(bbox[2], bbox[3])
+    if grid == "hexagon":
+        # hexagons with edge `size` are 1.5 `size` apart horizontally, and sqrt(3)
+        # `size` vertically
+        columns, rows = (
+            (east - west) / (1.5 * size),
+            (north - south) / (math.sqrt(3) * size),
+        )
+    else:
+        columns, rows = (east - west) / size, (north - south) / size
+    return (math.ceil(columns) + 1) * (math.ceil(rows) + 1)
+
+
+def build_aggregate_query(
+    bbox: List[float],
+    grid: str,
+    size: Optional[float] = None,
+    clusters: Optional[int] = None,
+    targets: Optional[List[AdaptationTargetRead]] = None,
+):
+    """
+    Select a JSON summary of the solutions in a bbox per grid cell (or k-means cluster):
+    the cell's GeoJSON `geometry`, its solution `count`, and the `mean`, `max` and
+    `count` of each adaptation target's values, by target type. Cells without
+    solutions are omitted.
+
+    Each solution is counted once, in the cell containing a point on its surface, so
+    solutions are included if that point is in the bbox. `square` and `hexagon` grids
+    have cells of `size` metres (the side of a square, or the edge of a hexagon) in
+    EPSG 3857, anchored at its origin, so cells are the same for every bbox. `kmeans`
+    groups solutions into `clusters` clusters, whose geometry is their centroid
+    """
+    envelope = func.ST_GeomFromWKB(bbox_area(bbox).wkb, 4326)
+    point = func.ST_PointOnSurface(NbsDBModel.geometry)
+    projected = func.ST_Transform(point, 3857)
+    located = select(NbsDBModel.id).where(
+        NbsDBModel.geometry.op("&&")(envelope), func.ST_Intersects(point, envelope)
+    )
+    if targets:
+        located = located.where(target_condition(targets))
+    if grid == "kmeans":
+        located = located.add_columns(
+            func.ST_ClusterKMeans(projected, clusters).over().label("i"),
+            literal(0).label("j"),
+            projected.label("point"),
+        )
+    else:
+        grid_function, cell_function = AGGREGATE_GRIDS[grid]
+        # a point's cell is the grid covering just that point. One on an edge is
+        # covered by more than one cell, and is put in the first
+        cell = (
+            select(getattr(func, grid_function)(size, projected).table_valued("i", "j"))
+            .limit(1)
+            .lateral("cell")
+        )
+        located = located.join(cell, true()).add_columns(cell.c.i, cell.c.j)
+    located = located.cte("located")
+    if grid == "kmeans":
+        shape = func.ST_Centroid(func.ST_Collect(located.c.point))
+    else:
+        shape = func.ST_SetSRID(
+            getattr(func, cell_function)(size, located.c.i, located.c.j), 3857
+        )
+    cells = (
+        select(
+            located.c.i,
+            located.c.j,
+            func.count().label("count"),
+            func.ST_AsGeoJSON(
+                func.ST_Transform(shape, 4326), settings.geojson_precision
+            ).label("geometry"),
+        )
+        .group_by(located.c.i, located.c.j)
+        .cte("cells")
+    )
+    statistics = (
+        select(
+            located.c.i,
+            located.c.j,
+            AdaptationTarget.target,
+            func.round(func.avg(Association.value), 2).label("mean"),
+            func.max(Association.value).label("max"),
+            func.count().label("count"),
+        )
+        .select_from(located)
+        .join(Association, Association.nbs_id == located.c.id)
+        .join(AdaptationTarget, Association.target_id == AdaptationTarget.id)
+        .group_by(located.c.i, located.c.j, AdaptationTarget.target)
+        .cte("statistics")
+    )
+    summary = func.json_build_object(
+        "mean", statistics.c.mean, "max", statistics.c.max, "count", statistics.c.count
+    )
+    # grouped by cell again, and joined to the cells, so each table is scanned once
+    cell_targets = (
+        select(
+            statistics.c.i,
+            statistics.c.j,
+            func.jsonb_object_agg(statistics.c.target, summary).label("targets"),
+        )
+        .group_by(statistics.c.i, statistics.c.j)
+        .cte("cell_targets")
+    )
+    return (
+        select(
+            cast(
+                func.json_build_object(
+                    "geometry",
+                    cast(cells.c.geometry, JSON),
+                    "count",
+                    cells.c.count,
+                    "targets",
+                    func.coalesce(cell_targets.c.targets, cast(literal("{}"), JSONB)),
+                ),
+                Text,
+            ).label("document")
+        )
+        .outerjoin(
+            cell_targets,
+            (cell_targets.c.i == cells.c.i) & (cell_targets.c.j == cells.c.j),
+        )
+        .order_by(cells.c.i, cells.c.j)
+    )
+
+
+@metrics.instrumented
+async def get_aggregates(
+    db_session: AsyncSession,
+    bbox: List[float],
+    grid: str,
+    size: Optional[float] = None,
+    clusters: Optional[int] = None,
+    targets: Optional[List[AdaptationTargetRead]] = None,
+) -> List[str]:
+    """Per-cell summaries of solutions, as serialised documents. See `build_aggregate_query`"""
+    if grid != "kmeans" and count_grid_cells(bbox, grid, size) > MAX_AGGREGATE_CELLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The bbox would be divided into more than {MAX_AGGREGATE_CELLS} cells: use a larger size",
+        )
+    await refresh_association_index(db_session, targets)
+    query = build_aggregate_query(bbox, grid, size, clusters, targets)
+    return (await db_session.scalars(query)).all()
+
+
+async def refresh_association_index(
+    db_session: AsyncSession, targets: Optional[List[AdaptationTargetRead]]
+):
+    """Rebuild the association index, if it's enabled, stale, and needed by a search"""
+    if targets and association_index is not None:
+        await association_index.refresh(db_session)
+
+
+def paginate(query, limit: Optional[int], cursor: Optional[int]):
+    """
+    Apply keyset pagination to a solution query: results are ordered by ID, and start
+    after the `cursor` ID
+    """
+    if limit is None and cursor is None:
+        return query
+    query = query.order_by(NbsDBModel.id)
+    if cursor is not None:
+        query = query.where(NbsDBModel.id > cursor)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
 
-        for cset in condition_sets:
-            # dynamically add WHERE clauses from the generated CTEs
-            query = query.where(NbsDBModel.id.in_(select(cset.c.nbs_id)))
 
-    res = (await db_session.scalars(query)).unique()
-    if res:
-        res = [await build_nbs_schema_from_model(model) for model in res]
-    return res
+def order_results(query, limit: Optional[int], cursor: Optional[int], q: Optional[str]):
+    """
+    Order a solution query: by relevance, most relevant first, if there's a text query
+    `q` (these can't be paginated with a cursor), and otherwise by ID (see `paginate`)
+    """
+    if not q:
+        return paginate(query, limit, cursor)
+    return query.order_by(text_rank(q).desc(), NbsDBModel.id).limit(limit)
 
 
+@metrics.instrumented
+async def get_filtered_solutions(
+    db_session: AsyncSession,
+    targets: Optional[List[AdaptationTargetRead]],
+    bbox: Optional[List[float]],
+    limit: Optional[int] = None,
+    cursor: Optional[int] = None,
+    geometry: Optional[Dict[str, Any]] = None,
+    q: Optional[str] = None,
+):
+    """
+    Retrieve matching solutions as (id, document) rows, where each document is a
+    serialised `NatureBasedSolutionRead`
+    """
+    await refresh_association_index(db_session, targets)
+    query = order_results(
+        build_filtered_query(targets, bbox, geometry, q), limit, cursor, q
+    )
+    query = select_documents(query, NbsDBModel.id)
+    return (await db_session.execute(query)).all()
+
+
+def stream_filtered_solutions(
+    targets: Optional[List[AdaptationTargetRead]],
+    bbox: Optional[List[float]],
+    limit: Optional[int] = None,
+    cursor: Optional[int] = None,
+    geometry: Optional[Dict[str, Any]] = None,
+    q: Optional[str] = None,
+    features: bool = False,
+):
+    """
+    Stream matching solutions from a server-side cursor as serialised
+    `NatureBasedSolutionRead` documents, or as GeoJSON Features with `features`. Only
+    `STREAM_BATCH_SIZE` rows are held in memory at once.
+
+    The query is built (and the filters validated) before anything is streamed, so
+    invalid filters raise here rather than part-way through a response. The stream uses
+    its own session, because the request's session is closed before a streaming response
+    is sent.
+    """
+    query = select_documents(
+        order_results(
+            build_filtered_query(targets, bbox, geometry, q), limit, cursor, q
+        ),
+        features=features,
+    ).execution_options(
+        yield_per=STREAM_BATCH_SIZE, operation="stream_filtered_solutions"
+    )
+
+    async def solutions():
+        async with sessionmanager.session() as db_session:
+            result = await db_session.stream_scalars(query)
+            async for batch in result.partitions():
+                for document in batch:
+                    yield document
+
+    return solutions()
+
+
+@metrics.instrumented
+async def get_solution_tile(db_session: AsyncSession, z: int, x: int, y: int) -> bytes:
+    """
+    Build a Mapbox vector tile of solution geometries, in a layer named "solutions".
+
+    Geometries are simplified to a tolerance of one tile pixel at this zoom level.
+    Each feature has the solution's `id` and `name`, and the values of its top
+    `TILE_TOP_TARGETS` adaptation targets, as attributes named for the target type
+    """
+    envelope = func.ST_TileEnvelope(z, x, y)
+    tolerance = WEB_MERCATOR_WIDTH / 2**z / MVT_EXTENT
+    top_targets = (
+        select(AdaptationTarget.target, Association.value)
+        .join(AdaptationTarget, Association.target_id == AdaptationTarget.id)
+        .where(Association.nbs_id == NbsDBModel.id)
+        .order_by(Association.value.desc())
+        .limit(TILE_TOP_TARGETS)
+        .lateral()
+    )
+    features = (
+        select(
+            func.ST_AsMVTGeom(
+                func.ST_SimplifyPreserveTopology(
+                    func.ST_Transform(NbsDBModel.geometry, 3857), tolerance
+                ),
+                envelope,
+                MVT_EXTENT,
+                MVT_BUFFER,
+            ).label("geom"),
+            NbsDBModel.id,
+            NbsDBModel.name,
+            func.jsonb_object_agg(top_targets.c.target, top_targets.c.value)
+            .filter(top_targets.c.target.is_not(None))
+            .label("targets"),
+        )
+        .outerjoin(top_targets, true())
+        .where(
+            func.ST_Intersects(NbsDBModel.geometry, func.ST_Transform(envelope, 4326))
+        )
+        .group_by(NbsDBModel.id)
+        .subquery()
+    )
+    tile = await db_session.scalar(
+        select(func.ST_AsMVT(features.table_valued(), "solutions", MVT_EXTENT, "geom"))
+    )
+    return bytes(tile or b"")
+
+
+def describe_target(target: TargetBase) -> str:
+    if target.id is None:
+        return f"with type {target.type}"
+    return f"with id {target.id}"
+
+
+@metrics.instrumented
 async def create_nature_based_solution(
     db_session: AsyncSession, solution: NatureBasedSolutionCreate
 ):
@@ -125,23 +998,197 @@ async def create_nature_based_solution(
         specificdetails=solution.specificdetails,
         location=solution.location,
     )
-    for adaptation in solution.adaptations:
-        target_id = adaptation.adaptation.id
+    # validate the targets against the cached catalogue: they can be given by ID or type
+    target_ids = await target_cache.resolve(
+        db_session, [adaptation.adaptation for adaptation in solution.adaptations]
+    )
+    for adaptation, target_id in zip(solution.adaptations, target_ids):
         value = adaptation.value
-        # Properly execute the select statement
-        result = await db_session.execute(
-            select(AdaptationTarget).where(AdaptationTarget.id == target_id)
-        )
-        target = result.scalars().first()
-        if not target:
+        if target_id is None:
             raise HTTPException(
                 status_code=404,
-                detail=f"AdaptationTarget with id {target_id} not found",
+                detail=f"AdaptationTarget {describe_target(adaptation.adaptation)} not found",
             )
-        association = Association(tg=target, value=value)
+        association = Association(target_id=target_id, value=value)
         db_solution.solution_targets.append(association)
         db_session.add(association)
     db_session.add(db_solution)
+    await db_session.flush()
+    solution_id = db_solution.id
     await db_session.commit()
-    await db_session.refresh(db_solution)
+    invalidate_solution_caches()
+    if association_index is not None:
+        association_index.add(
+            [
+                (
+                    solution_id,
+                    {
+                        target_id: adaptation.value
+                        for adaptation, target_id in zip(
+                            solution.adaptations, target_ids
+                        )
+                    },
+                )
+            ]
+        )
+    # reload the solution and its targets, which were expired by the commit
+    db_solution = await db_session.scalar(
+        select(NbsDBModel).where(NbsDBModel.id == solution_id).options(WITH_TARGETS)
+    )
     return await build_nbs_schema_from_model(db_solution)
+
+
+def parse_solution(record) -> NatureBasedSolutionCreate:
+    """Validate an incoming solution, given as a dict or as JSON"""
+    if isinstance(record, (str, bytes)):
+        return NatureBasedSolutionCreate.model_validate_json(record)
+    return NatureBasedSolutionCreate.model_validate(record)
+
+
+@metrics.instrumented
+async def ingest_solutions(
+    db_session: AsyncSession,
+    records: AsyncIterable,
+    chunk_size: int = INGEST_CHUNK_SIZE,
+) -> IngestReport:
+    """
+    Bulk-load solutions. Each record is a dict or JSON document in the shape of
+    `NatureBasedSolutionCreate`.
+
+    Records are consumed in chunks: each chunk's targets are resolved at once (creating
+    any new target types), then it's written using one multi-row INSERT for solutions
+    and one for their targets, and committed. Records which fail validation, use unknown
+    target IDs, or duplicate an existing name are reported and skipped without affecting
+    the rest of the batch. If writing a chunk fails, its records are written one at a
+    time, and those the database rejects are reported
+    """
+    report = IngestReport()
+    seen_names = set()
+    chunk = []
+    index = 0
+    async for record in records:
+        try:
+            chunk.append((index, parse_solution(record)))
+        except ValidationError as e:
+            report.errors.append(IngestError(index=index, detail=str(e)))
+        index += 1
+        if len(chunk) == chunk_size:
+            await ingest_chunk(db_session, chunk, report, seen_names)
+            chunk = []
+    if chunk:
+        await ingest_chunk(db_session, chunk, report, seen_names)
+    report.errors.sort(key=lambda error: error.index)
+    return report
+
+
+async def ingest_chunk(db_session, chunk, report, seen_names):
+    targets = [
+        adaptation.adaptation
+        for _, solution in chunk
+        for adaptation in solution.adaptations
+    ]
+    # targets given by type are created if they don't exist, but IDs must be valid
+    ids_by_name = await get_or_create_targets(
+        db_session, {target.type for target in targets if target.id is None}
+    )
+    given_ids = iter(
+        await target_cache.resolve(
+            db_session, [target for target in targets if target.id is not None]
+        )
+    )
+    target_ids = iter(
+        [
+            ids_by_name[target.type] if target.id is None else next(given_ids)
+            for target in targets
+        ]
+    )
+    pending = {}
+    for index, solution in chunk:
+        solution_target_ids = [next(target_ids) for _ in solution.adaptations]
+        detail = None
+        if solution.name in seen_names:
+            detail = "Duplicate solution name in this batch"
+        elif None in solution_target_ids:
+            missing = solution.adaptations[solution_target_ids.index(None)]
+            detail = f"AdaptationTarget {describe_target(missing.adaptation)} not found"
+        elif len(set(solution_target_ids)) < len(solution_target_ids):
+            detail = "Duplicate adaptation target"
+        if detail:
+            report.errors.append(
+                IngestError(index=index, name=solution.name, detail=detail)
+            )
+            continue
+        seen_names.add(solution.name)
+        pending[solution.name] = (index, solution, solution_target_ids)
+    if not pending:
+        return
+    try:
+        solution_ids = await write_solutions(db_session, pending)
+    except SQLAlchemyError:
+        # find the records which can't be written by writing them one at a time
+        logger.exception("Writing a chunk of %d solutions failed", len(pending))
+        await db_session.rollback()
+        solution_ids = {}
+        for name, record in list(pending.items()):
+            try:
+                solution_ids.update(await write_solutions(db_session, {name: record}))
+            except SQLAlchemyError:
+                # the details may include other records' data, so they're only logged
+                logger.exception("Writing solution %d failed", record[0])
+                await db_session.rollback()
+                del pending[name]
+                report.errors.append(
+                    IngestError(index=record[0], name=name, detail=WRITE_FAILED)
+                )
+
+    for name, (index, _, _) in pending.items():
+        if name in solution_ids:
+            report.created += 1
+        else:
+            report.errors.append(
+                IngestError(
+                    index=index,
+                    name=name,
+                    detail="A solution with this name already exists",
+                )
+            )
+
+
+async def write_solutions(db_session, pending) -> Dict[str, int]:
+    """
+    Insert and commit solutions given as a name -> (index, solution, target IDs) map,
+    using one statement for solutions and one for their targets. Returns the new
+    solutions' IDs by name: names which already exist are skipped
+    """
+    inserted = await db_session.execute(
+        pg_insert(NbsDBModel)
+        .values(
+            [
+                solution.model_dump(exclude={"adaptations"})
+                for _, solution, _ in pending.values()
+            ]
+        )
+        .on_conflict_do_nothing(index_elements=[NbsDBModel.name])
+        .returning(NbsDBModel.name, NbsDBModel.id)
+    )
+    solution_ids = dict(inserted.all())
+    associations = [
+        {"nbs_id": solution_ids[name], "target_id": target_id, "value": a.value}
+        for name, (_, solution, target_ids) in pending.items()
+        if name in solution_ids
+        for a, target_id in zip(solution.adaptations, target_ids)
+    ]
+    if associations:
+        await db_session.execute(insert(Association), associations)
+    await db_session.commit()
+    invalidate_solution_caches()
+    if association_index is not None:
+        association_index.add(
+            (
+                solution_ids[name],
+                dict(zip(target_ids, (a.value for a in solution.adaptations))),
+            )
+            for name, (_, solution, target_ids) in pending.items()
+            if name in solution_ids
+        )
+    return solution_ids
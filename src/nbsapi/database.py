@@ -1,16 +1,23 @@
+import asyncio
 import contextlib
-from typing import Any, AsyncIterator
+import time
+from typing import Any, AsyncIterator, Optional
 from urllib.parse import urlparse
 
+from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import (
     AsyncConnection,
+    AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from nbsapi import metrics, profiling
 from nbsapi.config import settings
+from nbsapi.tracing import StatementTracer
 
 Base = declarative_base()
 
@@ -41,9 +48,82 @@ def inject_driver(connection_string, driver="psycopg"):
     return replaced
 
 
+POOL_CHECKOUT_SECONDS = metrics.Histogram(
+    "nbsapi_db_pool_checkout_seconds",
+    "Time taken to check a connection out of the pool, including waiting for one",
+)
+POOL_TIMEOUTS = metrics.Counter(
+    "nbsapi_db_pool_timeouts_total",
+    "Connection checkouts which timed out waiting for a free connection",
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """A connection pool which records checkout latency and timeouts"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+
+
+def engine_options() -> dict[str, Any]:
+    """Engine and connection pool options, from settings"""
+    options = {
+        "echo": settings.echo_sql,
+        "poolclass": InstrumentedPool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+    if settings.db_statement_timeout:
+        options["connect_args"] = {
+            "options": f"-c statement_timeout={settings.db_statement_timeout}"
+        }
+    return options
+
+
 class DatabaseSessionManager:
+    """
+    The engine is created by `init`, when the app starts (or on first use, e.g. in
+    scripts), rather than on import: creating it loads the database driver. Once it's
+    closed, using it raises until `init` is called again, rather than creating an engine
+    which would never be disposed of
+    """
+
     def __init__(self, host: str, engine_kwargs: dict[str, Any] = {}):
-        self._engine = create_async_engine(host, **engine_kwargs)
+        self._host = host
+        self._engine_kwargs = engine_kwargs
+        self._engine: Optional[AsyncEngine] = None
+        self._sessionmaker: Optional[async_sessionmaker[AsyncSession]] = None
+        self._closed = False
+        self.tracer: Optional[StatementTracer] = None
+        if settings.slow_statement_ms or settings.statement_sample_rate:
+            self.tracer = StatementTracer(
+                slow_ms=settings.slow_statement_ms,
+                sample_rate=settings.statement_sample_rate,
+                capacity=settings.statement_trace_size,
+            )
+
+    def init(self):
+        """Create the engine, if it hasn't been created already"""
+        self._closed = False
+        if self._engine is not None:
+            return
+        self._engine = create_async_engine(self._host, **self._engine_kwargs)
+        if settings.metrics_enabled:
+            metrics.instrument_engine(self._engine.sync_engine)
+        if settings.profiling:
+            profiling.instrument_engine(self._engine.sync_engine)
+        if self.tracer is not None:
+            self.tracer.instrument(self._engine.sync_engine)
         self._sessionmaker = async_sessionmaker(autocommit=False, bind=self._engine)
 
     async def close(self):
@@ -53,12 +133,30 @@ class DatabaseSessionManager:
 
         self._engine = None
         self._sessionmaker = None
+        self._closed = True
+
+    def _lazy_init(self):
+        """Create the engine on first use, unless the manager has been closed"""
+        if self._closed:
+            raise Exception("DatabaseSessionManager is closed")
+        self.init()
+
+    async def warm_up(self, connections: int):
+        """
+        Open `connections` pooled connections at once, so that the first requests don't
+        each wait for one to be established
+        """
+        self._lazy_init()
+
+        async def check_out():
+            async with self._engine.connect() as connection:
+                await connection.exec_driver_sql("SELECT 1")
+
+        await asyncio.gather(*(check_out() for _ in range(connections)))
 
     @contextlib.asynccontextmanager
     async def connect(self) -> AsyncIterator[AsyncConnection]:
-        if self._engine is None:
-            raise Exception("DatabaseSessionManager is not initialized")
-
+        self._lazy_init()
         async with self._engine.begin() as connection:
             try:
                 yield connection
@@ -66,11 +164,21 @@ class DatabaseSessionManager:
                 await connection.rollback()
                 raise
 
+    def pool_status(self) -> Optional[dict[str, int]]:
+        """Connection counts for the pool, or None if there's no pool"""
+        if self._engine is None or not isinstance(self._engine.pool, InstrumentedPool):
+            return None
+        pool = self._engine.pool
+        return {
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "size": pool.size(),
+        }
+
     @contextlib.asynccontextmanager
     async def session(self) -> AsyncIterator[AsyncSession]:
-        if self._sessionmaker is None:
-            raise Exception("DatabaseSessionManager is not initialized")
-
+        self._lazy_init()
         session = self._sessionmaker()
         try:
             yield session
@@ -82,7 +190,27 @@ class DatabaseSessionManager:
 
 
 sessionmanager = DatabaseSessionManager(
-    inject_driver(settings.database_url), {"echo": settings.echo_sql}
+    inject_driver(settings.database_url), engine_options()
+)
+
+
+def _pool_connections():
+    status = sessionmanager.pool_status()
+    if status is None:
+        return None
+    return {(state,): status[state] for state in ("in_use", "idle", "overflow")}
+
+
+metrics.Gauge(
+    "nbsapi_db_pool_connections",
+    "Connections in the pool, by state",
+    _pool_connections,
+    labels=("state",),
+)
+metrics.Gauge(
+    "nbsapi_db_pool_size",
+    "Configured size of the connection pool, excluding overflow",
+    lambda: (sessionmanager.pool_status() or {}).get("size"),
 )
 
 
@@ -0,0 +1,188 @@
+"""
+Bulk export of the solution catalogue as Arrow IPC streams or GeoParquet files, with
+WKB geometries and a column of values per adaptation target. It needs pyarrow: install
+the `export` extra. FlatGeobuf isn't supported: it would need another writer, and
+GeoParquet is read by the same clients
+"""
+
+import functools
+import json
+from typing import AsyncIterator, List, Tuple
+
+from sqlalchemy import func, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from nbsapi.database import sessionmanager
+from nbsapi.models import AdaptationTarget, Association
+from nbsapi.models import NatureBasedSolution as NbsDBModel
+
+# number of rows fetched from the server-side cursor, and written as a record batch (or
+# Parquet row group), at a time
+EXPORT_BATCH_SIZE = 10_000
+# export formats, with their media types and file extensions
+FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+COLUMNS = ["id", "name", "definition", "cobenefits", "specificdetails", "location"]
+# target columns are named with this prefix, so any target type can be exported
+# without clashing with the solutions' columns (e.g. a target named "geometry")
+TARGET_PREFIX = "target:"
+
+
+@functools.cache
+def arrow():
+    """pyarrow, with its parquet module. It's imported on first use, to keep startup fast"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Exports need pyarrow: install nbsapi[export]")
+    return pyarrow
+
+
+class Sink:
+    """
+    A write-only file which hands what's written to it to a stream, so writers can
+    produce a response incrementally. Parquet writers need `tell`
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def build_schema(targets: List[str], format: str):
+    """
+    The export's schema: the solution's columns, its WKB `geometry`, and a nullable
+    column of values for each adaptation target, named `target:<type>`. Arrow streams mark
+    the geometry as a `geoarrow.wkb` extension column, and GeoParquet files carry `geo`
+    metadata. Coordinates are in EPSG 4326, which is GeoParquet's default CRS
+    """
+    pa = arrow()
+    geometry = pa.field("geometry", pa.binary())
+    if format == "arrow":
+        geometry = geometry.with_metadata({"ARROW:extension:name": "geoarrow.wkb"})
+    schema = pa.schema(
+        [
+            pa.field("id", pa.int32(), nullable=False),
+            *(pa.field(column, pa.string()) for column in COLUMNS[1:]),
+            geometry,
+            *(pa.field(TARGET_PREFIX + target, pa.int32()) for target in targets),
+        ]
+    )
+    if format == "parquet":
+        geo = {
+            "version": "1.0.0",
+            "primary_column": "geometry",
+            "columns": {"geometry": {"encoding": "WKB", "geometry_types": []}},
+        }
+        schema = schema.with_metadata({"geo": json.dumps(geo)})
+    return schema
+
+
+def build_export_query(targets: List[Tuple[int, str]]):
+    """
+    Select every solution, in ID order, with its geometry as WKB and its value for each
+    of the `targets` (or NULL). Each solution's values are pivoted from its associations
+    by a lateral subquery, so rows can be streamed as they're read
+    """
+    values = (
+        select(
+            *(
+                func.max(Association.value)
+                .filter(Association.target_id == target_id)
+                .label(f"target_{target_id}")
+                for target_id, _ in targets
+            )
+        )
+        .where(Association.nbs_id == NbsDBModel.id)
+        .lateral("target_values")
+    )
+    query = select(
+        *(getattr(NbsDBModel, column) for column in COLUMNS),
+        func.ST_AsBinary(NbsDBModel.geometry).label("geometry"),
+    )
+    if targets:
+        query = query.add_columns(*values.c).outerjoin(values, true())
+    return query.order_by(NbsDBModel.id)
+
+
+async def get_targets(db_session: AsyncSession) -> List[Tuple[int, str]]:
+    return (
+        await db_session.execute(
+            select(AdaptationTarget.id, AdaptationTarget.target).order_by(
+                AdaptationTarget.id
+            )
+        )
+    ).all()
+
+
+def write_batch(writer, schema, rows):
+    pa = arrow()
+    columns = list(zip(*rows))
+    writer.write_batch(
+        pa.RecordBatch.from_arrays(
+            [
+                pa.array(
+                    [bytes(value) if value is not None else None for value in column]
+                )
+                if field.name == "geometry"
+                else pa.array(column, type=field.type)
+                for field, column in zip(schema, columns)
+            ],
+            schema=schema,
+        )
+    )
+
+
+def export_solutions(format: str) -> AsyncIterator[bytes]:
+    """
+    Stream the catalogue in an export `format`, reading it from a server-side cursor
+    `EXPORT_BATCH_SIZE` rows at a time, so memory use doesn't grow with its size. Like
+    other streams, it uses its own session. A missing pyarrow raises here, rather than
+    part-way through a response
+    """
+    pa = arrow()
+
+    async def export():
+        async with sessionmanager.session() as db_session:
+            targets = await get_targets(db_session)
+            schema = build_schema([target for _, target in targets], format)
+            sink = Sink()
+            if format == "parquet":
+                writer = pa.parquet.ParquetWriter(sink, schema)
+            else:
+                writer = pa.ipc.new_stream(sink, schema)
+            query = build_export_query(targets).execution_options(
+                yield_per=EXPORT_BATCH_SIZE, operation="export_solutions"
+            )
+            result = await db_session.stream(query)
+            async for batch in result.partitions():
+                write_batch(writer, schema, batch)
+                yield sink.drain()
+            writer.close()
+            yield sink.drain()
+
+    return export()
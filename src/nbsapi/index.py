@@ -0,0 +1,155 @@
+"""
+An optional in-memory index of solutions' adaptation target values, which answers target
+filters with vectorised comparisons instead of a grouped query over the association
+table. It needs numpy: install the `index` extra, and set `ASSOCIATION_INDEX=true`
+"""
+
+import asyncio
+import functools
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from nbsapi import metrics
+from nbsapi.config import settings
+from nbsapi.models import AdaptationTarget, Association
+
+
+@functools.cache
+def numpy():
+    """numpy, imported when the index is created, to keep startup fast without it"""
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError(
+            "The association index needs numpy: install nbsapi[index], or unset ASSOCIATION_INDEX"
+        )
+    return numpy
+
+
+# the value of a target a solution doesn't have. Real values are 0 - 100
+MISSING = -1
+
+
+class AssociationIndex:
+    """
+    A dense (solutions × targets) matrix of association values, ordered by solution ID.
+
+    Solutions are appended as they're committed by this process. Other changes (to
+    targets, or to existing associations) invalidate it, and it's reloaded after `ttl`
+    seconds regardless, so that writes by other workers are eventually picked up
+    """
+
+    def __init__(self, ttl: float):
+        np = numpy()
+        self.ttl = ttl
+        self.ids = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0, 0), dtype=np.int8)
+        # target type -> column, and target ID -> column
+        self.columns: Dict[str, int] = {}
+        self._columns_by_id: Dict[int, int] = {}
+        self._pending: List[Tuple[int, Dict[int, int]]] = []
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    @metrics.instrumented
+    async def load(self, db_session: AsyncSession):
+        """
+        Unconditionally (re)build the index. Targets and associations are read in one
+        statement, so they're from the same snapshot: a target committed in between
+        two reads could otherwise have associations but no column. Targets without
+        associations are joined to NULLs
+        """
+        np = numpy()
+        joined = (
+            await db_session.execute(
+                select(
+                    Association.nbs_id,
+                    AdaptationTarget.id,
+                    Association.value,
+                    AdaptationTarget.target,
+                ).outerjoin(Association, Association.target_id == AdaptationTarget.id)
+            )
+        ).all()
+        targets = sorted({(row[1], row[3]) for row in joined})
+        rows = [row for row in joined if row[0] is not None]
+        self.columns = {name: column for column, (_, name) in enumerate(targets)}
+        self._columns_by_id = {
+            target_id: column for column, (target_id, _) in enumerate(targets)
+        }
+        solution_ids = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+        columns = np.fromiter(
+            (self._columns_by_id[row[1]] for row in rows), np.int64, len(rows)
+        )
+        values = np.fromiter((row[2] for row in rows), np.int8, len(rows))
+        self.ids, rows_of = np.unique(solution_ids, return_inverse=True)
+        self.values = np.full((len(self.ids), len(targets)), MISSING, np.int8)
+        self.values[rows_of, columns] = values
+        self._pending = []
+        self._loaded_at = time.monotonic()
+
+    async def refresh(self, db_session: AsyncSession):
+        """Rebuild the index if it's stale"""
+        if self.stale:
+            async with self._lock:
+                if self.stale:
+                    await self.load(db_session)
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def add(self, solutions: Iterable[Tuple[int, Dict[int, int]]]):
+        """
+        Add newly-committed solutions, given as (solution ID, {target ID: value}) pairs.
+        They're merged into the matrix on the next search
+        """
+        for solution_id, values in solutions:
+            if not values.keys() <= self._columns_by_id.keys():
+                # a target we haven't seen
+                self.invalidate()
+                return
+            self._pending.append((solution_id, values))
+
+    def match(self, thresholds: Dict[str, int]):
+        """
+        The IDs of solutions whose value for each target type is at least its threshold,
+        in ascending order
+        """
+        np = numpy()
+        self._merge()
+        mask = np.ones(len(self.ids), dtype=bool)
+        for target_type, value in thresholds.items():
+            column = self.columns.get(target_type)
+            if column is None:
+                return self.ids[:0]
+            mask &= self.values[:, column] >= value
+        return self.ids[mask]
+
+    def _merge(self):
+        if not self._pending:
+            return
+        np = numpy()
+        values = np.full((len(self._pending), len(self.columns)), MISSING, np.int8)
+        for row, (_, solution_values) in enumerate(self._pending):
+            for target_id, value in solution_values.items():
+                values[row, self._columns_by_id[target_id]] = value
+        ids = np.fromiter((solution_id for solution_id, _ in self._pending), np.int64)
+        self._pending = []
+        self.ids = np.concatenate([self.ids, ids])
+        self.values = np.concatenate([self.values, values])
+        if np.any(self.ids[1:] < self.ids[:-1]):
+            order = np.argsort(self.ids, kind="stable")
+            self.ids, self.values = self.ids[order], self.values[order]
+
+
+association_index: Optional[AssociationIndex] = (
+    AssociationIndex(ttl=settings.association_index_ttl)
+    if settings.association_index
+    else None
+)
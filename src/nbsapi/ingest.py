@@ -0,0 +1,87 @@
+"""
+Bulk load nature-based solutions from a file
+
+Usage: python -m nbsapi.ingest solutions.ndjson [--format ndjson] [--chunk-size 1000]
+
+The file contains `NatureBasedSolutionCreate` objects, either as a JSON array or as
+newline-delimited JSON (one object per line). The format is taken from the file
+extension unless `--format` is given. A report of the records which couldn't be added
+is printed as JSON, and the exit status is 1 if there were any.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from typing import AsyncIterable, AsyncIterator, Iterable
+
+from nbsapi.crud.naturebasedsolution import INGEST_CHUNK_SIZE, ingest_solutions
+from nbsapi.database import sessionmanager
+
+# bytes read from a file at a time when bulk loading it
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+async def read_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Split a stream of bytes into NDJSON records, skipping blank lines"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+async def iterate(records: Iterable) -> AsyncIterator:
+    for record in records:
+        yield record
+
+
+async def read_chunks(f) -> AsyncIterator[bytes]:
+    """Read a binary file in `FILE_CHUNK_SIZE` chunks, in a thread"""
+    while chunk := await asyncio.to_thread(f.read, FILE_CHUNK_SIZE):
+        yield chunk
+
+
+async def read_file(f, file_format: str) -> AsyncIterator:
+    """
+    The records in a binary file. Reads happen in a thread, so they don't block the
+    event loop, and NDJSON files are streamed
+    """
+    if file_format == "json":
+        records = await asyncio.to_thread(json.load, f)
+        if not isinstance(records, list):
+            raise ValueError("A JSON file must contain an array of solutions")
+        return iterate(records)
+    return read_ndjson(read_chunks(f))
+
+
+async def ingest_file(path: str, file_format: str, chunk_size: int):
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        records = await read_file(f, file_format)
+        async with sessionmanager.session() as session:
+            report = await ingest_solutions(session, records, chunk_size)
+    finally:
+        f.close()
+    await sessionmanager.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["json", "ndjson"])
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    args = parser.parse_args()
+    file_format = args.format or ("json" if args.path.endswith(".json") else "ndjson")
+    report = asyncio.run(ingest_file(args.path, file_format, args.chunk_size))
+    print(report.model_dump_json(indent=2))
+    sys.exit(1 if report.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,50 @@
-from contextlib import asynccontextmanager
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from nbsapi.api.middleware import MetricsMiddleware, RequestContextMiddleware
 from nbsapi.api.routers.adaptationtargets import router as adaptations_router
+from nbsapi.api.routers.metrics import router as metrics_router
 from nbsapi.api.routers.naturebasedsolutions import router as solutions_router
+from nbsapi.cache import target_cache
 from nbsapi.config import settings
 from nbsapi.database import sessionmanager
+from nbsapi.index import association_index
+from nbsapi.profiling import ProfilingMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up():
+    """Open pooled connections and load the in-memory catalogues"""
+    try:
+        await sessionmanager.warm_up(
+            min(settings.db_pool_warm_up, settings.db_pool_size)
+        )
+        async with sessionmanager.session() as session:
+            await target_cache.load(session)
+            if association_index is not None:
+                await association_index.load(session)
+    except Exception:
+        # they're loaded on first use instead
+        logger.exception("Warming up failed")
 
 
-# Load solutions from JSON fixture on startup
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # global solutions
-    # json_file_path = os.path.join(os.path.dirname(__file__), "solutions.json")
-    # with open(json_file_path, "r") as f:
-    #     solutions_data = json.load(f)
-    #     solutions = [NatureBasedSolution(**solution) for solution in solutions_data]
+    # the app can serve requests while warming up: the caches are loaded when they're
+    # first needed if it hasn't finished
+    sessionmanager.init()
+    warming_up = asyncio.create_task(warm_up())
     yield
+    warming_up.cancel()
+    # let it stop before the engine it's using is disposed of
+    with suppress(asyncio.CancelledError):
+        await warming_up
     if sessionmanager._engine is not None:
         # Close the DB connection
         await sessionmanager.close()
@@ -35,6 +61,7 @@ async def root():
 # Routers
 app.include_router(solutions_router)
 app.include_router(adaptations_router)
+app.include_router(metrics_router)
 
 
 origins = ["*"]
@@ -45,7 +72,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Profile-Id"],
 )
 
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
+app.add_middleware(RequestContextMiddleware)
+
+if settings.profiling:
+    app.add_middleware(ProfilingMiddleware)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", reload=True, port=8000)
@@ -0,0 +1,288 @@
+"""
+A minimal metrics registry, exported in the Prometheus text format at `/metrics`
+"""
+
+import abc
+import contextlib
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from sqlalchemy import event
+
+from nbsapi.config import settings
+
+# latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _labels(self, key: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.labels, key))
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[Sample]:
+        """The metric's current values, for exposition"""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        for key, value in list(self._values.items()):
+            yield self.name, self._labels(key), value
+
+
+class Gauge(Metric):
+    """
+    A gauge which is read when metrics are collected: `function` returns its value, or
+    a dict of values keyed by label values
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        function: Callable[[], Optional[Union[float, Dict[LabelValues, float]]]],
+        labels: Sequence[str] = (),
+    ):
+        super().__init__(name, description, labels)
+        self.function = function
+
+    def samples(self) -> Iterable[Sample]:
+        values = self.function()
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield self.name, self._labels(key), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        # per label set: bucket counts (the last one is +Inf), count, and sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._values[key]
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def samples(self) -> Iterable[Sample]:
+        for key, (counts, total) in list(self._values.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+            yield f"{self.name}_count", labels, cumulative
+            yield f"{self.name}_sum", labels, total[0]
+
+
+registry: List[Metric] = []
+
+
+def format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        escaped = ",".join(
+            '{}="{}"'.format(
+                label,
+                str(label_value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for label, label_value in labels.items()
+        )
+        name = f"{name}{{{escaped}}}"
+    return f"{name} {value:g}" if isinstance(value, float) else f"{name} {value}"
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(format_sample(*sample) for sample in metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram(
+    "nbsapi_request_duration_seconds",
+    "Time taken to handle requests, until the response body has been sent",
+    ("method", "route"),
+)
+REQUESTS = Counter(
+    "nbsapi_requests_total", "Requests handled", ("method", "route", "status")
+)
+QUERY_SECONDS = Histogram(
+    "nbsapi_db_query_seconds",
+    "SQL statement execution time, by the operation which issued it",
+    ("operation",),
+)
+QUERY_ROWS = Histogram(
+    "nbsapi_db_query_rows",
+    "Rows returned or affected per SQL statement, where known",
+    ("operation",),
+    buckets=ROW_BUCKETS,
+)
+PHASE_SECONDS = Histogram(
+    "nbsapi_phase_seconds",
+    "Time spent in phases of request handling which aren't SQL, e.g. serialisation",
+    ("phase",),
+)
+
+# the operation (usually a CRUD function) issuing SQL statements
+current_operation: ContextVar[str] = ContextVar("current_operation", default="other")
+# the ASGI scope of the request being handled, which has its route once it's matched
+current_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar(
+    "current_scope", default=None
+)
+# the nbsapi.profiling.Profile of the request being handled, if it asked to be profiled
+current_profile: ContextVar[Optional[Any]] = ContextVar("current_profile", default=None)
+
+
+def route_name(scope: Optional[Dict[str, Any]] = None) -> str:
+    """The path template of the matched route, e.g. `/api/solutions/solutions/{solution_id}`"""
+    scope = current_scope.get() if scope is None else scope
+    route = scope.get("route") if scope else None
+    return getattr(route, "path", "unmatched")
+
+
+def instrumented(function):
+    """
+    Label the SQL statements executed by an async function with its name. This is
+    cheap, and the label is used by the statement tracer too, so it's always on
+    """
+
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        token = current_operation.set(function.__qualname__)
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            current_operation.reset(token)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def _time_phase(name: str, profile):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if settings.metrics_enabled:
+            PHASE_SECONDS.observe(seconds, phase=name)
+        if profile is not None:
+            profile.phases[name] = profile.phases.get(name, 0.0) + seconds
+
+
+def phase(name: str):
+    """Time a block of non-SQL work, such as serialisation"""
+    profile = current_profile.get()
+    if not settings.metrics_enabled and profile is None:
+        return contextlib.nullcontext()
+    return _time_phase(name, profile)
+
+
+def statement_operation(context) -> str:
+    """
+    The operation which issued a statement: an `operation` execution option wins, since
+    streamed statements run outside the function which built them
+    """
+    return context.execution_options.get("operation") or current_operation.get()
+
+
+def instrument_engine(engine):
+    """Record the timing and row count of every SQL statement run by the engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        context._nbsapi_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        operation = statement_operation(context)
+        QUERY_SECONDS.observe(
+            time.perf_counter() - context._nbsapi_start, operation=operation
+        )
+        if cursor.rowcount >= 0:
+            QUERY_ROWS.observe(cursor.rowcount, operation=operation)
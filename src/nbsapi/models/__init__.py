@@ -2,4 +2,4 @@ from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()  # model base class
 from .adaptation_target import AdaptationTarget
-from .naturebasedsolution import Association, NatureBasedSolution
+from .naturebasedsolution import Association, NatureBasedSolution, SolutionDocument
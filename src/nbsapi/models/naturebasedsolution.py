@@ -1,10 +1,13 @@
 from __future__ import annotations
 
-from geoalchemy2 import Geometry, WKBElement
-from sqlalchemy import Column, ForeignKey, Table
+from typing import Optional
+
+from sqlalchemy import Column, Computed, ForeignKey, Index, Table, Text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from . import Base
+from .types import Geometry
 
 
 class Association(Base):
@@ -15,9 +18,14 @@ class Association(Base):
     target_id: Mapped[int] = mapped_column(
         ForeignKey("adaptationtarget.id"), primary_key=True
     )
-    tg = relationship("AdaptationTarget", lazy="joined", back_populates="solutions")
+    # relationships are never loaded implicitly: queries which need them must say how,
+    # using loader options such as `selectinload`, so that loading is visible and can't
+    # cascade across the association table
+    tg = relationship("AdaptationTarget", lazy="raise", back_populates="solutions")
 
-    solution = relationship("NatureBasedSolution", back_populates="solution_targets")
+    solution = relationship(
+        "NatureBasedSolution", lazy="raise", back_populates="solution_targets"
+    )
     value: Mapped[int]
 
     @property
@@ -25,22 +33,57 @@ class Association(Base):
         return self.tg
 
 
+# the text search configuration used for solutions' search documents and queries
+SEARCH_CONFIG = "english"
+# a solution's search document, with matches in its name ranked highest
+SEARCH_DOCUMENT = f"""
+    setweight(to_tsvector('{SEARCH_CONFIG}', name), 'A')
+    || setweight(to_tsvector('{SEARCH_CONFIG}', definition), 'B')
+    || setweight(to_tsvector('{SEARCH_CONFIG}', cobenefits || ' ' || specificdetails), 'C')
+    || setweight(to_tsvector('{SEARCH_CONFIG}', location), 'D')
+"""
+
+
 class NatureBasedSolution(Base):
     __tablename__ = "naturebasedsolution"
+    __table_args__ = (
+        Index("ix_naturebasedsolution_search", "search", postgresql_using="gin"),
+        Index("idx_naturebasedsolution_geometry", "geometry", postgresql_using="gist"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(index=True, unique=True)
-    definition: Mapped[str] = mapped_column(index=True)
-    cobenefits: Mapped[str] = mapped_column(index=True)
-    specificdetails: Mapped[str] = mapped_column(index=True)
-    location: Mapped[str] = mapped_column(index=True)
-    geometry: Mapped[WKBElement] = mapped_column(
-        Geometry("GEOMETRY", srid=4326), spatial_index=True, nullable=True
+    definition: Mapped[str]
+    cobenefits: Mapped[str]
+    specificdetails: Mapped[str]
+    location: Mapped[str]
+    # geometries are only read and written in SQL, so never loaded
+    geometry: Mapped[Optional[bytes]] = mapped_column(
+        Geometry("GEOMETRY", srid=4326), nullable=True, deferred=True
+    )
+    # generated by Postgres, and only used in queries, so never loaded
+    search: Mapped[str] = mapped_column(
+        TSVECTOR, Computed(SEARCH_DOCUMENT, persisted=True), deferred=True
     )
 
     solution_targets = relationship(
         "Association",
         back_populates="solution",
-        lazy="joined",
+        lazy="raise",
         collection_class=list,
         cascade="all, delete-orphan",
     )
+
+
+class SolutionDocument(Base):
+    """
+    A denormalised read model: each solution's serialised document, and its targets as a
+    {type: value} map. Rows are maintained by triggers on the solution, association and
+    target tables (see the migration which adds them), so they're never written here
+    """
+
+    __tablename__ = "nbs_document"
+    nbs_id: Mapped[int] = mapped_column(
+        ForeignKey("naturebasedsolution.id", ondelete="CASCADE"), primary_key=True
+    )
+    targets: Mapped[dict] = mapped_column(JSONB)
+    document: Mapped[str] = mapped_column(Text)
@@ -0,0 +1,23 @@
+"""
+PostGIS column types. They only name the types: geometries are converted in SQL (e.g.
+`ST_GeomFromWKB`, `ST_AsBinary`), so the app doesn't need geoalchemy2, which imports
+shapely and numpy. Migrations still use geoalchemy2's types
+"""
+
+from sqlalchemy.types import UserDefinedType
+
+
+class Geometry(UserDefinedType):
+    cache_ok = True
+
+    def __init__(self, geometry_type: str = "GEOMETRY", srid: int = 4326):
+        self.geometry_type = geometry_type
+        self.srid = srid
+
+    def get_col_spec(self, **kw) -> str:
+        return f"geometry({self.geometry_type},{self.srid})"
+
+
+class Geography(Geometry):
+    def get_col_spec(self, **kw) -> str:
+        return f"geography({self.geometry_type},{self.srid})"
@@ -0,0 +1,225 @@
+"""
+Opt-in request profiling. With `PROFILING=true`, a request sent with the
+`PROFILE_TOKEN` in an `X-Profile` header has its SQL statements, their bound parameters
+and `EXPLAIN (ANALYZE, BUFFERS)` plans, its phase timings, and a cProfile breakdown
+written to the rotating log at `PROFILE_LOG`. The response's `X-Profile-Id` header
+identifies its entry
+"""
+
+import cProfile
+import io
+import logging
+import pstats
+import secrets
+import time
+import uuid
+from dataclasses import dataclass, field
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+from nbsapi import metrics
+from nbsapi.config import settings
+
+HEADER = "x-profile"
+# bound parameters longer than this (e.g. WKB geometries) are truncated in the log
+MAX_PARAMETER_LENGTH = 200
+# functions listed in the cProfile breakdown
+PROFILE_FUNCTIONS = 40
+
+logger = logging.getLogger("nbsapi.profile")
+logger.propagate = False
+
+
+@dataclass
+class Statement:
+    sql: str
+    parameters: str
+    operation: str
+    seconds: float
+    rows: int
+    plan: str
+
+
+@dataclass
+class Profile:
+    method: str
+    path: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    statements: List[Statement] = field(default_factory=list)
+    phases: Dict[str, float] = field(default_factory=dict)
+    profiler: Optional[cProfile.Profile] = None
+    seconds: float = 0.0
+    status: int = 500
+
+    def report(self) -> str:
+        sql_seconds = sum(statement.seconds for statement in self.statements)
+        total = f"total {self.seconds * 1000:.2f} ms, {len(self.statements)} statements"
+        lines = [
+            f"=== {self.id} {self.method} {self.path} {self.status}",
+            f"{total} in {sql_seconds * 1000:.2f} ms",
+        ]
+        lines.extend(
+            f"phase {name}: {seconds * 1000:.2f} ms"
+            for name, seconds in self.phases.items()
+        )
+        for number, statement in enumerate(self.statements, 1):
+            lines.append(
+                f"--- statement {number} ({statement.operation}):"
+                f" {statement.seconds * 1000:.2f} ms, {statement.rows} rows"
+            )
+            lines.extend([statement.sql, f"parameters: {statement.parameters}"])
+            lines.append(statement.plan)
+        if self.profiler is not None:
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=stream)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_FUNCTIONS)
+            lines.extend(["--- cProfile", stream.getvalue()])
+        return "\n".join(lines)
+
+
+def format_parameters(parameters) -> str:
+    if isinstance(parameters, dict):
+        items = {key: _truncate(value) for key, value in parameters.items()}
+        return repr(items)
+    return repr([_truncate(value) for value in parameters or ()])
+
+
+def _truncate(value):
+    text = repr(value)
+    if len(text) > MAX_PARAMETER_LENGTH:
+        return f"{text[:MAX_PARAMETER_LENGTH]}... ({len(text)} characters)"
+    return value
+
+
+def explain(
+    dbapi_connection,
+    statement: str,
+    parameters,
+    analyze: bool,
+    errors: Tuple[type, ...] = (DBAPIError,),
+) -> str:
+    """
+    `EXPLAIN (ANALYZE, BUFFERS)` a statement, in a savepoint which is rolled back, since
+    ANALYZE runs it again. Writes are only planned: running them again would fail on the
+    rows they've just written. Statements which can't be explained (e.g. `COMMIT`) raise
+    one of `errors`, which are reported in the plan. Raw DBAPI connections raise their
+    driver's errors, rather than SQLAlchemy's
+    """
+    options = "ANALYZE, BUFFERS" if analyze else "BUFFERS"
+    explain_cursor = dbapi_connection.cursor()
+    try:
+        explain_cursor.execute("SAVEPOINT nbsapi_profile")
+        try:
+            explain_cursor.execute(f"EXPLAIN ({options}) {statement}", parameters)
+            return "\n".join(row[0] for row in explain_cursor.fetchall())
+        finally:
+            explain_cursor.execute("ROLLBACK TO SAVEPOINT nbsapi_profile")
+    except errors as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        explain_cursor.close()
+
+
+def instrument_engine(engine):
+    """Record the statements run by the engine for profiled requests"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        context._nbsapi_profile_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        profile = metrics.current_profile.get()
+        if profile is None:
+            return
+        seconds = time.perf_counter() - context._nbsapi_profile_start
+        profile.statements.append(
+            Statement(
+                sql=statement,
+                parameters=format_parameters(parameters),
+                operation=metrics.statement_operation(context),
+                seconds=seconds,
+                rows=cursor.rowcount,
+                plan="(executemany: not explained)"
+                if many
+                else explain(
+                    conn.connection.dbapi_connection,
+                    statement,
+                    parameters,
+                    analyze=not (
+                        context.isinsert or context.isupdate or context.isdelete
+                    ),
+                    errors=(DBAPIError, conn.dialect.loaded_dbapi.Error),
+                ),
+            )
+        )
+
+
+def configure_logger():
+    if not logger.handlers:
+        handler = RotatingFileHandler(
+            settings.profile_log,
+            maxBytes=settings.profile_log_max_bytes,
+            backupCount=settings.profile_log_backups,
+        )
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests which ask for it with the `PROFILE_TOKEN` in an `X-Profile` header,
+    since profiles run statements again and log their parameters. cProfile sees
+    everything running on the event loop, so profiles of concurrent requests include
+    each other's work: only one request at a time is cProfiled, and the breakdown is most
+    useful when the server is otherwise idle
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.requested(scope):
+            await self.app(scope, receive, send)
+            return
+        configure_logger()
+        profile = Profile(method=scope["method"], path=scope["path"])
+        if not self._profiling:
+            self._profiling = True
+            profile.profiler = cProfile.Profile()
+        token = metrics.current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-id", profile.id.encode()),
+                ]
+            await send(message)
+
+        start = time.perf_counter()
+        if profile.profiler is not None:
+            profile.profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profile.profiler is not None:
+                profile.profiler.disable()
+                self._profiling = False
+            profile.seconds = time.perf_counter() - start
+            metrics.current_profile.reset(token)
+            logger.info(profile.report())
+
+    @staticmethod
+    def requested(scope) -> bool:
+        if not settings.profile_token:
+            return False
+        for name, value in scope["headers"]:
+            if name == HEADER.encode():
+                return secrets.compare_digest(value, settings.profile_token.encode())
+        return False
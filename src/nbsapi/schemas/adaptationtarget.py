@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel, ConfigDict, Field
 from typing_extensions import Annotated
 
@@ -7,6 +9,7 @@ class TargetBase(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+    id: Optional[int] = None
     type: str
 
 
@@ -1,4 +1,4 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -56,3 +56,69 @@ class NatureBasedSolutionRead(NatureBasedSolutionBase):
         description="List of AdaptationTarget and their corresponding values",
         default_factory=list,
     )
+
+
+class RankedNatureBasedSolutionRead(NatureBasedSolutionRead):
+    score: float = Field(..., description="Ranking score. Higher is better")
+
+
+class NearbyNatureBasedSolutionRead(NatureBasedSolutionRead):
+    distance: float = Field(
+        ..., description="Geodesic distance from the requested point, in metres"
+    )
+
+
+class TargetSummary(BaseModel):
+    "The values of an adaptation target in an aggregated cell"
+
+    mean: float
+    max: int
+    count: int = Field(
+        ..., description="Number of solutions in the cell with the target"
+    )
+
+
+class AggregateCell(BaseModel):
+    "A summary of the nature-based solutions in a grid cell or cluster"
+
+    geometry: Dict[str, Any] = Field(
+        ...,
+        description="The cell as a GeoJSON Polygon, or a k-means cluster's centroid as a Point",
+    )
+    count: int = Field(..., description="Number of solutions in the cell")
+    targets: Dict[str, TargetSummary] = Field(
+        ..., description="Summaries of the solutions' target values, by target type"
+    )
+
+
+class NatureBasedSolutionBatch(BaseModel):
+    "Solutions fetched by ID"
+
+    solutions: List[NatureBasedSolutionRead] = Field(
+        ..., description="The solutions which exist, in the order they were requested"
+    )
+    missing: List[int] = Field(
+        ...,
+        description="Requested IDs with no solution, in the order they were requested",
+    )
+
+
+class IdList(BaseModel):
+    ids: List[int] = Field(..., examples=[[1, 2, 3]])
+
+
+class IngestError(BaseModel):
+    "A record which couldn't be added during a bulk load"
+
+    index: int = Field(..., description="Position of the record in the input, from 0")
+    name: Optional[str] = Field(None, description="Name of the solution, if valid")
+    detail: str
+
+
+class IngestReport(BaseModel):
+    "The outcome of a bulk load of nature-based solutions"
+
+    created: int = Field(0, description="Number of solutions added")
+    errors: List[IngestError] = Field(
+        default_factory=list, description="Records which were skipped, and why"
+    )
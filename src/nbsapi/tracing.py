@@ -0,0 +1,156 @@
+"""
+A slow-statement log, and a sampling tracer, for finding the SQL behind tail latency
+without echoing every statement. Statements are recorded by their fingerprint (their
+text with literals and bound parameters replaced by `?`), so nothing sensitive is kept
+"""
+
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple
+
+from sqlalchemy import event
+
+from nbsapi import metrics
+
+logger = logging.getLogger("nbsapi.slow_statements")
+
+_PARAMETER = re.compile(r"%\([^)]+\)s(::\w+(\[\])?)?|%s|\$\d+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(\.\d+)?(?![\w.])")
+_LIST = re.compile(r"\(\s*\?(\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Normalise a statement so that executions differing only in their values match:
+    `WHERE id IN (%(id_1)s, %(id_2)s)` becomes `WHERE id IN (...)`
+    """
+    statement = _PARAMETER.sub("?", statement)
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _LIST.sub("(...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+class TracedStatement(NamedTuple):
+    at: float
+    fingerprint: str
+    # a short, stable ID for the fingerprint, for grouping
+    id: str
+    milliseconds: float
+    rows: int
+    route: str
+    operation: str
+
+    def as_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+class StatementTracer:
+    """
+    Statements slower than `slow_ms` are logged, and kept in a ring buffer of the last
+    `capacity`. A `sample_rate` fraction of all statements are kept in another
+    """
+
+    def __init__(self, slow_ms: float, sample_rate: float, capacity: int):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.slow: Deque[TracedStatement] = deque(maxlen=capacity)
+        self.sampled: Deque[TracedStatement] = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, seconds: float, rows: int, operation: str):
+        milliseconds = seconds * 1000
+        slow = self.slow_ms > 0 and milliseconds >= self.slow_ms
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not (slow or sampled):
+            return
+        normalised = fingerprint(statement)
+        traced = TracedStatement(
+            at=time.time(),
+            fingerprint=normalised,
+            id=hashlib.blake2b(normalised.encode(), digest_size=6).hexdigest(),
+            milliseconds=milliseconds,
+            rows=rows,
+            route=metrics.route_name(),
+            operation=operation,
+        )
+        with self._lock:
+            if slow:
+                self.slow.append(traced)
+            if sampled:
+                self.sampled.append(traced)
+        if slow:
+            logger.warning(
+                "slow statement %s: %.1f ms, %d rows, %s (%s): %s",
+                traced.id,
+                milliseconds,
+                rows,
+                traced.route,
+                operation,
+                normalised,
+            )
+
+    def offenders(self) -> List[Dict[str, Any]]:
+        """The slow statements grouped by fingerprint, by total time, descending"""
+        groups: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            slow = list(self.slow)
+        for traced in slow:
+            group = groups.setdefault(
+                traced.id,
+                {
+                    "id": traced.id,
+                    "fingerprint": traced.fingerprint,
+                    "count": 0,
+                    "total_milliseconds": 0.0,
+                    "max_milliseconds": 0.0,
+                    "routes": set(),
+                },
+            )
+            group["count"] += 1
+            group["total_milliseconds"] += traced.milliseconds
+            group["max_milliseconds"] = max(
+                group["max_milliseconds"], traced.milliseconds
+            )
+            group["routes"].add(traced.route)
+        for group in groups.values():
+            group["routes"] = sorted(group["routes"])
+        return sorted(
+            groups.values(), key=lambda group: group["total_milliseconds"], reverse=True
+        )
+
+    def report(self, limit: int) -> Dict[str, Any]:
+        """The most recent slow and sampled statements, newest first"""
+        with self._lock:
+            slow = list(self.slow)[::-1][:limit]
+            sampled = list(self.sampled)[::-1][:limit]
+        return {
+            "slow_ms": self.slow_ms,
+            "sample_rate": self.sample_rate,
+            "offenders": self.offenders()[:limit],
+            "slow": [traced.as_dict() for traced in slow],
+            "sampled": [traced.as_dict() for traced in sampled],
+        }
+
+    def instrument(self, engine):
+        """Record the statements run by the engine"""
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+            context._nbsapi_trace_start = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+            self.record(
+                statement,
+                time.perf_counter() - context._nbsapi_trace_start,
+                cursor.rowcount,
+                metrics.statement_operation(context),
+            )
@@ -1,13 +1,1163 @@
+import asyncio
+import importlib
 import json
-from unittest.mock import patch
+import os
+import subprocess
+import sys
+import time
+from unittest.mock import AsyncMock, MagicMock, call, patch
 
+import pytest
+import shapely
+from fastapi import FastAPI, HTTPException
 from fastapi.testclient import TestClient
+from shapely.geometry import (
+    GeometryCollection,
+    LineString,
+    MultiPolygon,
+    Point,
+    Polygon,
+    box,
+    shape,
+)
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 
+from nbsapi import ingest, profiling
+from nbsapi.api.middleware import RequestContextMiddleware
+from nbsapi.api.responses import RawJSONResponse
+from nbsapi.api.routers.naturebasedsolutions import (
+    MAX_BATCH_IDS,
+    feature_collection,
+    search_cache_key,
+)
+from nbsapi.cache import (
+    ResponseCache,
+    TargetCache,
+    invalidate_solution_caches,
+    response_cache,
+    target_cache,
+    tile_cache,
+)
+from nbsapi.config import settings
+from nbsapi.crud.adaptationtarget import get_or_create_statement, get_or_create_targets
+from nbsapi.crud.naturebasedsolution import (
+    MAX_SUBDIVISION_CELLS,
+    WRITE_FAILED,
+    build_aggregate_query,
+    build_filtered_query,
+    build_nearest_query,
+    build_ranked_query,
+    count_grid_cells,
+    geodesic_area,
+    get_intersecting_geometries,
+    get_solutions_by_id,
+    order_results,
+    paginate,
+    parse_geometry,
+    select_documents,
+    subdivide,
+)
+from nbsapi.database import (
+    DatabaseSessionManager,
+    get_db_session,
+    inject_driver,
+    sessionmanager,
+)
+from nbsapi.export import Sink, build_export_query, build_schema, write_batch
+from nbsapi.index import AssociationIndex
+from nbsapi.ingest import iterate, read_ndjson
 from nbsapi.main import app
+from nbsapi.metrics import (
+    Counter,
+    Histogram,
+    Metric,
+    current_operation,
+    current_profile,
+    instrumented,
+    phase,
+    registry,
+    route_name,
+    statement_operation,
+)
+from nbsapi.models import NatureBasedSolution
+from nbsapi.schemas.adaptationtarget import AdaptationTargetRead, TargetBase
+from nbsapi.tracing import StatementTracer, fingerprint
 
 client = TestClient(app)
 
+# seconds to import nbsapi.main. FastAPI, pydantic and SQLAlchemy take about 1 s
+IMPORT_TIME_BUDGET = 2.0
+# libraries which are only imported when they're first used
+LAZY_IMPORTS = ("shapely", "geojson", "geoalchemy2", "numpy", "pyproj", "pyarrow")
+
+
+def import_extra(module: str):
+    """
+    Import a library from an optional extra. Tests needing it are skipped if it isn't
+    installed, except in CI, which installs every extra
+    """
+    if os.environ.get("CI"):
+        return importlib.import_module(module)
+    return pytest.importorskip(module)
+
 
 def test_nbsapi():
     t = True
     assert t, True
+
+
+def test_area_guard():
+    # the example bbox from the API docs is roughly 0.17 sq km
+    assert 150_000 < geodesic_area(box(-73.968, 40.781, -73.962, 40.784)) < 200_000
+    get_intersecting_geometries(box(-74.0, 40.7, -73.9, 40.8))
+    with pytest.raises(HTTPException):
+        get_intersecting_geometries(box(-74.0, 40.0, -73.0, 41.0))
+
+
+def test_geometry_validation():
+    polygon = {
+        "type": "Polygon",
+        "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]],
+    }
+    assert parse_geometry(polygon).equals(shape(polygon))
+    with pytest.raises(HTTPException):
+        parse_geometry({"type": "Point", "coordinates": [0, 0]})
+    with pytest.raises(HTTPException):
+        parse_geometry({"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1]]]})
+
+
+def test_subdivision():
+    small = box(-73.968, 40.781, -73.962, 40.784)
+    assert subdivide(small) == [small]
+    large = box(0, 0, 0.12, 0.12)
+    pieces = subdivide(large, cell_size=0.05)
+    assert len(pieces) == 9
+    assert sum(piece.area for piece in pieces) == pytest.approx(large.area)
+    sql = str(get_intersecting_geometries(large).compile(dialect=postgresql.dialect()))
+    assert "unnest" in sql
+    # small parts far apart are split separately, so the grid doesn't span the gap
+    spread = MultiPolygon([box(0, 0, 0.01, 0.01), box(60, 60, 60.01, 60.01)])
+    start = time.perf_counter()
+    assert subdivide(spread) == list(spread.geoms)
+    get_intersecting_geometries(spread)
+    # a thin polygon with a large extent is split into larger cells
+    sliver = Polygon([(0, 0), (60, 59.99), (60, 60), (0, 0)])
+    pieces = subdivide(sliver)
+    assert len(pieces) <= MAX_SUBDIVISION_CELLS
+    assert sum(piece.area for piece in pieces) == pytest.approx(sliver.area)
+    assert time.perf_counter() - start < 5
+    # repairing a bow tie leaves a MultiPolygon, and lines are dropped
+    bow_tie = {
+        "type": "Polygon",
+        "coordinates": [[[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]]],
+    }
+    assert isinstance(parse_geometry(bow_tie), MultiPolygon)
+    collection = GeometryCollection([box(0, 0, 1, 1), LineString([(2, 2), (3, 3)])])
+    assert subdivide(collection, cell_size=2) == [box(0, 0, 1, 1)]
+
+
+def test_filtered_query_is_a_single_statement():
+    targets = [
+        AdaptationTargetRead(adaptation=TargetBase(type=target), value=value)
+        for target, value in [("Heat", 50), ("Drought", 30), ("Heat", 60)]
+    ]
+    query = build_filtered_query(targets, [-73.968, 40.781, -73.962, 40.784])
+    compiled = query.compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert "WITH" not in sql
+    assert "HAVING count(DISTINCT nbs_target_assoc.target_id)" in sql
+    # repeated target types are collapsed to the strictest threshold
+    assert 2 in compiled.params.values()
+    assert 60 in compiled.params.values() and 50 not in compiled.params.values()
+
+
+def test_read_model(monkeypatch):
+    heat = AdaptationTargetRead(adaptation=TargetBase(type="Heat"), value=50)
+    monkeypatch.setattr(settings, "read_model", True)
+    query = select_documents(build_filtered_query([heat], None), NatureBasedSolution.id)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    # documents and targets come from the read model, without aggregating associations
+    assert "JOIN nbs_document ON naturebasedsolution.id = nbs_document.nbs_id" in sql
+    assert "json_agg" not in sql and "GROUP BY" not in sql
+    assert "CAST((nbs_document.targets ->> %(targets_1)s) AS INTEGER) >=" in sql
+
+
+def test_geojson_features(monkeypatch):
+    query = select_documents(build_filtered_query(None, None), features=True)
+    sql = str(query.compile(compile_kwargs={"literal_binds": True}))
+    # geometries are serialised by Postgres, around the usual solution document
+    assert "CAST(ST_AsGeoJSON(naturebasedsolution.geometry, 6) AS JSON)" in sql
+    assert "'properties', CAST(CAST(json_build_object('name'" in sql
+    monkeypatch.setattr(settings, "read_model", True)
+    sql = str(select_documents(build_filtered_query(None, None), features=True))
+    assert "CAST(nbs_document.document AS JSON)" in sql
+
+    async def features():
+        for feature in ['{"type": "Feature", "id": 1}', '{"type": "Feature", "id": 2}']:
+            yield feature
+
+    async def collect():
+        return "".join([chunk async for chunk in feature_collection(features())])
+
+    collection = json.loads(asyncio.run(collect()))
+    assert collection["type"] == "FeatureCollection"
+    assert [feature["id"] for feature in collection["features"]] == [1, 2]
+
+
+def test_keyset_pagination():
+    query = paginate(build_filtered_query(None, None), limit=20, cursor=100)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert "WHERE naturebasedsolution.id > " in sql
+    # the limit applies to solutions: nothing is eagerly joined to them
+    assert "ORDER BY naturebasedsolution.id \n LIMIT %(param_1)s" in sql
+    assert "JOIN" not in sql
+    # unpaginated queries are left alone
+    assert "ORDER BY" not in str(paginate(build_filtered_query(None, None), None, None))
+
+
+def test_text_search_query():
+    heat = AdaptationTargetRead(adaptation=TargetBase(type="Heat"), value=10)
+    query = build_filtered_query([heat], None, q="wetland restoration")
+    sql = str(
+        order_results(query, 10, None, "wetland restoration").compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    # the text, target and area filters are one statement
+    assert (
+        "naturebasedsolution.search @@ websearch_to_tsquery('english'::regconfig" in sql
+    )
+    assert "GROUP BY nbs_target_assoc.nbs_id" in sql
+    assert "ORDER BY ts_rank(naturebasedsolution.search" in sql
+    # the generated column is never loaded
+    assert "naturebasedsolution.search," not in str(select_documents(query))
+    response = client.post(
+        "/api/solutions/solutions", json={"q": "wetland", "cursor": 10}
+    )
+    assert response.status_code == 400
+
+
+def test_nearest_query():
+    heat = AdaptationTargetRead(adaptation=TargetBase(type="Heat"), value=60)
+    sql = str(
+        build_nearest_query([-73.965, 40.782], [heat], 20, max_distance=500).compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    # a KNN scan of the spatial index finds candidates, whose limit-th geodesic distance
+    # bounds a second, indexed search of boxes wrapped around the antimeridian
+    assert "ORDER BY naturebasedsolution.geometry <-> ST_GeomFromWKB" in sql
+    assert "WITH radius AS" in sql and "OFFSET" in sql
+    assert "naturebasedsolution.geometry && ST_Expand" in sql
+    assert "naturebasedsolution.geometry && ST_Translate(ST_Expand" in sql
+    assert "GROUP BY nbs_target_assoc.nbs_id" in sql
+    assert sql.count("ST_Distance(CAST(naturebasedsolution.geometry AS geography(") == 5
+    assert sql.count("LIMIT") == 3
+    sql = str(build_nearest_query([-73.965, 40.782], None).compile())
+    # without a maximum, only the candidates' distance bounds the search
+    assert sql.count("ST_Translate(ST_Expand") == 2
+    response = client.post("/api/solutions/nearest", json={"point": [200, 40]})
+    assert response.status_code == 400
+
+
+def test_aggregate_query():
+    heat = AdaptationTargetRead(adaptation=TargetBase(type="Heat"), value=60)
+    bbox = [-74.26, 40.48, -73.7, 40.92]
+    sql = str(
+        build_aggregate_query(bbox, "hexagon", 1000, targets=[heat]).compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    # solutions are put in cells and summarised in one statement, one row per cell
+    assert (
+        "JOIN LATERAL (SELECT anon_1.i AS i, anon_1.j AS j \nFROM ST_HexagonGrid("
+        in sql
+    )
+    assert "GROUP BY located.i, located.j, adaptationtarget.target" in sql
+    assert "ST_Hexagon(%(ST_Hexagon_1)s, located.i, located.j)" in sql
+    assert "GROUP BY nbs_target_assoc.nbs_id" in sql
+    # target summaries are joined to the cells, not looked up once per cell
+    assert "FROM cells LEFT OUTER JOIN cell_targets ON" in sql
+    assert "WHERE statistics.i = cells.i" not in sql
+    sql = str(build_aggregate_query(bbox, "kmeans", clusters=8).compile())
+    assert "ST_ClusterKMeans" in sql and "ST_Centroid(ST_Collect(located.point))" in sql
+    assert count_grid_cells(bbox, "square", 1000) == 4224
+    assert count_grid_cells(bbox, "hexagon", 1000) < 4224
+    for body in (
+        {"bbox": bbox, "size": 10},
+        {"bbox": bbox, "grid": "kmeans"},
+        {"bbox": [1, 1, 0, 0], "size": 1000},
+    ):
+        response = client.post("/api/solutions/aggregate", json=body)
+        assert response.status_code == 400
+
+
+def test_ranked_query():
+    heat = AdaptationTargetRead(adaptation=TargetBase(type="Heat"), value=10)
+    bbox = [-73.968, 40.781, -73.962, 40.784]
+    sql = str(
+        build_ranked_query([heat], bbox, weights={"Heat": 2.0}).compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    # the score is computed in the target filter, and only the top k rows are built
+    assert "sum(CASE WHEN (adaptationtarget.target = %(target_1)s)" in sql
+    assert sql.count("GROUP BY") == 1
+    assert "DESC, naturebasedsolution.id \n LIMIT" in sql
+    assert "ST_Distance" not in sql
+    sql = str(
+        build_ranked_query([heat], bbox, proximity_weight=1, limit=5).compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    assert "ST_Distance" in sql
+    with pytest.raises(HTTPException):
+        build_ranked_query([heat], bbox, weights={"Drought": 1.0})
+    with pytest.raises(HTTPException):
+        build_ranked_query(None, None, proximity_weight=1)
+    with pytest.raises(HTTPException):
+        build_ranked_query(None, bbox)
+
+
+def test_raw_json_response():
+    documents = ['{"id" : 1, "solution_targets" : []}', '{"id" : 2}']
+    assert json.loads(RawJSONResponse(documents).body) == [
+        {"id": 1, "solution_targets": []},
+        {"id": 2},
+    ]
+    assert json.loads(RawJSONResponse([]).body) == []
+    assert RawJSONResponse(documents[1]).body == b'{"id" : 2}'
+
+
+def test_target_cache():
+    rows = MagicMock()
+    rows.all.return_value = [(1, "Heat"), (2, "Drought")]
+    db_session = MagicMock(execute=AsyncMock(return_value=rows))
+    cache = TargetCache(ttl=60, miss_interval=10)
+
+    async def exercise():
+        assert await cache.targets(db_session) == {1: "Heat", 2: "Drought"}
+        assert await cache.resolve(
+            db_session, [TargetBase(type="Drought"), TargetBase(id=1, type="Heat")]
+        ) == [2, 1]
+        assert await cache.get_name(db_session, 1) == "Heat"
+        assert db_session.execute.await_count == 1
+        # unknown targets only reload a catalogue loaded over miss_interval seconds ago
+        assert await cache.get_name(db_session, 3) is None
+        assert await cache.resolve(db_session, [TargetBase(type="Frost")]) == [None]
+        assert db_session.execute.await_count == 1
+        # in case another worker has added them
+        cache._loaded_at -= 10
+        rows.all.return_value = [(1, "Heat"), (2, "Drought"), (3, "Frost")]
+        await asyncio.gather(
+            *(cache.resolve(db_session, [TargetBase(type="Frost")]) for _ in range(3))
+        )
+        assert await cache.get_name(db_session, 3) == "Frost"
+        assert db_session.execute.await_count == 2
+        cache.invalidate()
+        await cache.targets(db_session)
+        assert db_session.execute.await_count == 3
+
+    asyncio.run(exercise())
+    assert cache.version == 3
+
+
+def test_export():
+    sql = str(build_export_query([(1, "Heat"), (2, "Drought")]).compile())
+    # targets are pivoted into columns by a lateral subquery, so rows stream in ID order
+    assert "LEFT OUTER JOIN LATERAL (SELECT max(nbs_target_assoc.value) FILTER" in sql
+    assert sql.endswith("ORDER BY naturebasedsolution.id")
+    pa = import_extra("pyarrow")
+    import pyarrow.parquet as pq
+
+    rows = [
+        (1, "a", "b", "c", "d", "e", Point(1, 2).wkb, 80, None),
+        (2, "f", "g", "h", "i", "j", None, None, 20),
+    ]
+    for format in ("arrow", "parquet"):
+        schema = build_schema(["Heat", "Drought"], format)
+        # target types can't clash with the solutions' columns
+        assert build_schema(["geometry"], format).get_field_index("geometry") != -1
+        sink = Sink()
+        if format == "parquet":
+            writer = pq.ParquetWriter(sink, schema)
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        write_batch(writer, schema, rows[:1])
+        write_batch(writer, schema, rows[1:])
+        writer.close()
+        data = sink.drain()
+        if format == "parquet":
+            table = pq.read_table(pa.BufferReader(data))
+            assert (
+                json.loads(table.schema.metadata[b"geo"])["primary_column"]
+                == "geometry"
+            )
+        else:
+            table = pa.ipc.open_stream(data).read_all()
+        assert table.column("target:Heat").to_pylist() == [80, None]
+        assert table.column("target:Drought").to_pylist() == [None, 20]
+        assert shapely.from_wkb(table.column("geometry")[0].as_py()) == Point(1, 2)
+
+
+def test_association_index():
+    import_extra("numpy")
+    # targets and their associations are read together, in one snapshot
+    rows = MagicMock()
+    rows.all.return_value = [
+        (10, 1, 80, "Heat"),
+        (10, 2, 20, "Drought"),
+        (11, 1, 50, "Heat"),
+        (12, 2, 90, "Drought"),
+        (None, 3, None, "Flood"),
+    ]
+    db_session = MagicMock(execute=AsyncMock(return_value=rows))
+    index = AssociationIndex(ttl=60)
+    asyncio.run(index.load(db_session))
+    assert db_session.execute.await_count == 1
+    assert not index.stale
+    assert index.columns == {"Heat": 0, "Drought": 1, "Flood": 2}
+    assert index.match({"Heat": 50}).tolist() == [10, 11]
+    assert index.match({"Heat": 50, "Drought": 10}).tolist() == [10]
+    assert index.match({"Flood": 0}).tolist() == []
+    # solutions added out of order are merged into ID order
+    index.add([(14, {2: 95}), (13, {1: 60, 2: 99})])
+    assert index.match({"Drought": 90}).tolist() == [12, 13, 14]
+    # unknown targets invalidate the index
+    index.add([(15, {4: 10})])
+    assert index.stale
+
+
+def test_get_or_create_targets():
+    sql = str(
+        get_or_create_statement(["Heat", "Frost"]).compile(dialect=postgresql.dialect())
+    )
+    assert "ON CONFLICT (target) DO NOTHING RETURNING" in sql
+    assert "UNION ALL" in sql
+
+    cache = MagicMock(known_ids=AsyncMock(return_value={"Heat": 1}))
+    rows = MagicMock()
+    rows.all.return_value = [("Frost", 7)]
+    db_session = MagicMock(execute=AsyncMock(return_value=rows), commit=AsyncMock())
+    with patch("nbsapi.crud.adaptationtarget.target_cache", cache):
+        ids = asyncio.run(get_or_create_targets(db_session, ["Heat", "Frost"]))
+        assert ids == {"Heat": 1, "Frost": 7}
+        # only the new target goes to the database, in one statement
+        assert db_session.execute.await_count == 1
+        cache.add.assert_called_once_with({"Frost": 7})
+        asyncio.run(get_or_create_targets(db_session, ["Heat"]))
+        assert db_session.execute.await_count == 1
+
+
+def test_read_ndjson():
+    async def collect():
+        chunks = iterate([b'{"a": 1}\n{"b"', b": 2}\n\n", b'{"c": 3}'])
+        return [line async for line in read_ndjson(chunks)]
+
+    assert asyncio.run(collect()) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+def test_read_file(tmp_path, monkeypatch):
+    # files are read in a thread a chunk at a time, so records span chunks
+    monkeypatch.setattr(ingest, "FILE_CHUNK_SIZE", 4)
+    (tmp_path / "solutions.ndjson").write_bytes(b'{"a": 1}\n\n{"b": 2}\n')
+    (tmp_path / "solutions.json").write_bytes(b'[{"a": 1}, {"b": 2}]')
+    (tmp_path / "object.json").write_bytes(b'{"a": 1}')
+
+    async def collect(name, file_format):
+        with open(tmp_path / name, "rb") as f:
+            return [record async for record in await ingest.read_file(f, file_format)]
+
+    assert asyncio.run(collect("solutions.ndjson", "ndjson")) == [
+        b'{"a": 1}',
+        b'{"b": 2}',
+    ]
+    assert asyncio.run(collect("solutions.json", "json")) == [{"a": 1}, {"b": 2}]
+    with pytest.raises(ValueError):
+        asyncio.run(collect("object.json", "json"))
+
+
+def test_ingest(caplog):
+    def solution(name, *adaptations):
+        return {**NEW_SOLUTION, "name": name, "adaptations": list(adaptations)}
+
+    flood = {"adaptation": {"id": 99, "type": "Flood"}, "value": 5}
+    payload = [
+        solution("a", HEAT),
+        {"name": "invalid"},
+        solution("a", HEAT),
+        solution("unknown target", flood),
+        solution("repeated target", HEAT, HEAT),
+        solution("rejected", HEAT),
+        solution("exists", HEAT),
+    ]
+
+    def rows(*values):
+        result = MagicMock()
+        result.all.return_value = list(values)
+        return result
+
+    # the chunk's write fails, so its records are written one at a time: "a" is added,
+    # "rejected" fails, and "exists" conflicts with an existing name
+    db_session = MagicMock(
+        execute=AsyncMock(
+            side_effect=[
+                SQLAlchemyError("secret connection details"),
+                rows(("a", 1)),
+                rows(),
+                SQLAlchemyError("secret connection details"),
+                rows(),
+            ]
+        ),
+        commit=AsyncMock(),
+        rollback=AsyncMock(),
+    )
+    cache = MagicMock(resolve=AsyncMock(return_value=[None]))
+    app.dependency_overrides[get_db_session] = lambda: db_session
+    try:
+        with (
+            patch(
+                "nbsapi.crud.naturebasedsolution.get_or_create_targets",
+                AsyncMock(return_value={"Heat": 1}),
+            ),
+            patch("nbsapi.crud.naturebasedsolution.target_cache", cache),
+        ):
+            response = client.post("/api/solutions/add_solutions/", json=payload)
+            assert (
+                client.post("/api/solutions/add_solutions/", json={}).status_code == 422
+            )
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert report["created"] == 1
+    errors = {error["index"]: error for error in report["errors"]}
+    assert sorted(errors) == [1, 2, 3, 4, 5, 6]
+    assert errors[1]["name"] is None
+    assert errors[2]["detail"] == "Duplicate solution name in this batch"
+    assert errors[3]["detail"] == "AdaptationTarget with id 99 not found"
+    assert errors[4]["detail"] == "Duplicate adaptation target"
+    assert errors[5] == {"index": 5, "name": "rejected", "detail": WRITE_FAILED}
+    assert errors[6]["detail"] == "A solution with this name already exists"
+    # database errors are logged, not returned
+    assert "secret" not in response.text
+    assert "secret connection details" in caplog.text
+    assert db_session.rollback.await_count == 2
+    assert db_session.commit.await_count == 2
+
+
+def test_response_cache():
+    cache = ResponseCache(max_bytes=10, ttl=60)
+    first = cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    assert cache.get("a") == first
+    # "b" is now the least recently used entry, so it's evicted to make room
+    cache.set("c", b"123")
+    assert cache.get("b") is None
+    assert cache.get("a").etag == first.etag
+    assert cache.size == 8
+    cache.clear()
+    assert cache.get("a") is None
+    expired = ResponseCache(max_bytes=10, ttl=-1)
+    expired.set("a", b"1")
+    assert expired.get("a") is None
+
+
+def test_cached_tiles():
+    assert client.get("/api/solutions/tiles/1/2/0.mvt").status_code == 404
+    # cached tiles are served without touching the database
+    tile = tile_cache.set((1, 0, 0), b"tile")
+    response = client.get("/api/solutions/tiles/1/0/0.mvt")
+    assert response.content == b"tile"
+    assert response.headers["etag"] == tile.etag
+    response = client.get(
+        "/api/solutions/tiles/1/0/0.mvt", headers={"If-None-Match": tile.etag}
+    )
+    assert response.status_code == 304
+    invalidate_solution_caches()
+    assert tile_cache.get((1, 0, 0)) is None
+
+
+def test_cached_responses():
+    document = '{"id": 1}'
+    with patch(
+        "nbsapi.api.routers.naturebasedsolutions.get_solution",
+        AsyncMock(return_value=document),
+    ) as get_solution:
+        response = client.get("/api/solutions/solutions/1")
+        etag = response.headers["etag"]
+        assert response.json() == {"id": 1}
+        response = client.get(
+            "/api/solutions/solutions/1", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert get_solution.await_count == 1
+        invalidate_solution_caches()
+        assert response_cache.get(("solution", 1)) is None
+        client.get("/api/solutions/solutions/1")
+        assert get_solution.await_count == 2
+    invalidate_solution_caches()
+
+    heat = AdaptationTargetRead(adaptation=TargetBase(type="Heat"), value=10)
+    flood = AdaptationTargetRead(adaptation=TargetBase(id=2, type="Flood"), value=20)
+    bbox = [-73.968, 40.781, -73.962, 40.784]
+    assert search_cache_key([heat, flood], bbox, None, None, None) == search_cache_key(
+        [flood, heat], bbox, None, None, None
+    )
+    assert search_cache_key([heat], bbox, None, 10, None) != search_cache_key(
+        [heat], bbox, None, 10, 5
+    )
+
+
+def test_metrics():
+    histogram = Histogram("test_latency_seconds", "Test", ("route",), buckets=(0.1, 1))
+    counter = Counter("test_requests_total", "Test")
+    try:
+        histogram.observe(0.05, route="/a")
+        histogram.observe(0.5, route="/a")
+        histogram.observe(5, route="/a")
+        counter.inc()
+        text = client.get("/metrics").text
+        assert "# TYPE test_latency_seconds histogram" in text
+        assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+        assert 'test_latency_seconds_bucket{route="/a",le="1"} 2' in text
+        assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 3' in text
+        assert 'test_latency_seconds_sum{route="/a"} 5.55' in text
+        assert "test_requests_total 1" in text
+        # the pool is reported before any connections have been made
+        assert "nbsapi_db_pool_size 5" in text
+    finally:
+        registry.remove(histogram)
+        registry.remove(counter)
+    # metric types must say how they're exposed
+    with pytest.raises(TypeError):
+        Metric("test_untyped", "Test")
+
+
+def test_request_and_query_metrics():
+    client.get("/api/solutions/tiles/1/2/0.mvt")
+    client.get("/no/such/route")
+    text = client.get("/metrics").text
+    # requests are labelled by route template, not path
+    assert (
+        'nbsapi_requests_total{method="GET",'
+        'route="/api/solutions/tiles/{z}/{x}/{y}.mvt",status="404"}'
+    ) in text
+    assert 'nbsapi_requests_total{method="GET",route="unmatched",status="404"}' in text
+    assert "nbsapi_request_duration_seconds_count" in text
+
+    @instrumented
+    async def load_things():
+        return current_operation.get()
+
+    assert asyncio.run(load_things()).endswith("load_things")
+    assert current_operation.get() == "other"
+    # streamed statements are labelled with an execution option instead
+    context = MagicMock(execution_options={"operation": "stream_things"})
+    assert statement_operation(context) == "stream_things"
+
+
+class StatementCounter:
+    """Count the SQL statements run by an engine, and the rows they return or affect"""
+
+    def __init__(self, engine):
+        self.engine = engine.sync_engine
+        self.statements = 0
+        self.rows = 0
+
+    def __enter__(self):
+        event.listen(self.engine, "after_cursor_execute", self.count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "after_cursor_execute", self.count)
+
+    def count(self, conn, cursor, statement, parameters, context, many):
+        self.statements += 1
+        self.rows += max(cursor.rowcount, 0)
+
+
+# a dedicated database for tests which need one, migrated to the current revision. Its
+# tables are emptied and reseeded, so it must not be the app's `DATABASE_URL`
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+# solutions seeded into the test database
+TEST_SOLUTIONS = 20
+
+
+def execute_sql(*statements: str):
+    """Run statements on the test database, returning the last one's rows"""
+
+    async def execute():
+        engine = create_async_engine(
+            inject_driver(TEST_DATABASE_URL),
+            poolclass=NullPool,
+            connect_args={"connect_timeout": 2},
+        )
+        try:
+            async with engine.begin() as conn:
+                for statement in statements:
+                    result = await conn.execute(text(statement))
+                return result.all() if result.returns_rows else None
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(execute())
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """
+    Point the app at the test database, seeded with `TEST_SOLUTIONS` solutions (without
+    geometries) and two targets. Tests using it are skipped if `TEST_DATABASE_URL`
+    isn't set, except in CI, where they fail
+    """
+    if not TEST_DATABASE_URL:
+        if os.environ.get("CI"):
+            pytest.fail("TEST_DATABASE_URL must be set in CI")
+        pytest.skip("TEST_DATABASE_URL isn't set")
+    if TEST_DATABASE_URL == settings.database_url:
+        pytest.fail("TEST_DATABASE_URL must be a dedicated database, not DATABASE_URL")
+    execute_sql(
+        "TRUNCATE nbs_target_assoc, naturebasedsolution, adaptationtarget"
+        " RESTART IDENTITY CASCADE",
+        "INSERT INTO adaptationtarget (target) VALUES ('Heat'), ('Drought')",
+        "INSERT INTO naturebasedsolution"
+        " (name, definition, cobenefits, specificdetails, location)"
+        " SELECT 'solution ' || n, 'definition', 'cobenefits', 'details', 'location'"
+        f" FROM generate_series(1, {TEST_SOLUTIONS}) AS n",
+        "INSERT INTO nbs_target_assoc (nbs_id, target_id, value)"
+        " SELECT solution.id, target.id, 50"
+        " FROM naturebasedsolution solution, adaptationtarget target",
+    )
+    # a fresh engine, without a pool, so nothing outlives the test. The originals are
+    # restored afterwards
+    monkeypatch.setattr(sessionmanager, "_host", inject_driver(TEST_DATABASE_URL))
+    monkeypatch.setattr(sessionmanager, "_engine_kwargs", {"poolclass": NullPool})
+    monkeypatch.setattr(sessionmanager, "_engine", None)
+    monkeypatch.setattr(sessionmanager, "_sessionmaker", None)
+    target_cache.invalidate()
+    invalidate_solution_caches()
+    yield
+    target_cache.invalidate()
+    invalidate_solution_caches()
+
+
+@pytest.fixture
+def postgis(database):
+    """The test database, with PostGIS required"""
+    try:
+        execute_sql("SELECT postgis_version()")
+    except Exception:
+        if os.environ.get("CI"):
+            raise
+        pytest.skip("The test database doesn't have PostGIS")
+
+
+HEAT = {"adaptation": {"type": "Heat"}, "value": 10}
+NEW_SOLUTION = {
+    "name": "statement budget test",
+    "definition": "d",
+    "cobenefits": "c",
+    "specificdetails": "s",
+    "location": "l",
+    "adaptations": [HEAT, {"adaptation": {"type": "Drought"}, "value": 5}],
+}
+
+
+def delete_new_solution():
+    solution = (
+        f"SELECT id FROM naturebasedsolution WHERE name = '{NEW_SOLUTION['name']}'"
+    )
+    execute_sql(
+        f"DELETE FROM nbs_target_assoc WHERE nbs_id IN ({solution})",
+        f"DELETE FROM naturebasedsolution WHERE id IN ({solution})",
+    )
+
+
+# method, path, JSON body, maximum statements, maximum rows
+STATEMENT_BUDGETS = [
+    # served from the target cache
+    ("GET", "/api/targets/target", None, 0, 0),
+    ("GET", "/api/solutions/solutions/1", None, 1, 1),
+    ("GET", "/api/solutions/solutions?ids=1,0", None, 1, 1),
+    ("POST", "/api/solutions/solutions", {"limit": 10}, 1, 11),
+    ("POST", "/api/solutions/solutions", {"targets": [HEAT], "limit": 10}, 1, 11),
+    ("POST", "/api/solutions/solutions", {"targets": [HEAT], "rank": True}, 1, 10),
+    ("POST", "/api/solutions/solutions", {"q": "solution", "limit": 10}, 1, 11),
+    # insert the solution and its targets, then load them: solution, targets
+    ("POST", "/api/solutions/add_solution/", NEW_SOLUTION, 4, 6),
+]
+
+
+def test_batch_fetch(monkeypatch):
+    assert client.get("/api/solutions/solutions?ids=1,x").status_code == 400
+    # IDs which don't fit in a Postgres integer can't be queried
+    assert client.get("/api/solutions/solutions?ids=99999999999").status_code == 400
+    assert (
+        client.post("/api/solutions/solutions/batch", json={"ids": [-(2**31) - 1]})
+    ).status_code == 400
+    too_many = {"ids": list(range(MAX_BATCH_IDS + 1))}
+    assert (
+        client.post("/api/solutions/solutions/batch", json=too_many).status_code == 400
+    )
+
+    async def get_solutions_by_id(db_session, solution_ids):
+        documents = {2: '{"id":2}', 3: '{"id":3}'}
+        return (
+            [documents[i] for i in solution_ids if i in documents],
+            [i for i in solution_ids if i not in documents],
+        )
+
+    monkeypatch.setattr(
+        "nbsapi.api.routers.naturebasedsolutions.get_solutions_by_id",
+        get_solutions_by_id,
+    )
+    response_cache.clear()
+    try:
+        response = client.get("/api/solutions/solutions?ids=3,1,2")
+        assert response.json() == {"solutions": [{"id": 3}, {"id": 2}], "missing": [1]}
+        response = client.post(
+            "/api/solutions/solutions/batch", json={"ids": [3, 1, 2]}
+        )
+        assert response.json()["missing"] == [1]
+    finally:
+        response_cache.clear()
+
+
+def test_get_solutions_by_id():
+    result = MagicMock()
+    result.all.return_value = [(2, '{"id":2}'), (3, '{"id":3}')]
+    db_session = MagicMock(execute=AsyncMock(return_value=result))
+    documents, missing = asyncio.run(get_solutions_by_id(db_session, [3, 1, 2, 3, 1]))
+    # requested order, without repeats, from one statement
+    assert documents == ['{"id":3}', '{"id":2}']
+    assert missing == [1]
+    query = db_session.execute.await_args.args[0]
+    params = query.compile(dialect=postgresql.dialect()).params
+    assert [3, 1, 2] in params.values()
+
+
+def test_aggregate(postgis):
+    # half the solutions in the first 1 km cell east of (0, 0), half in the third
+    execute_sql(
+        "UPDATE naturebasedsolution SET geometry = ST_SetSRID(ST_MakePoint("
+        f"CASE WHEN id <= {TEST_SOLUTIONS // 2} THEN 0.001 ELSE 0.02 END, 0.001), 4326)"
+    )
+    bbox = [-0.01, -0.01, 0.05, 0.01]
+    with TestClient(app) as test_client:
+        for body in (
+            {"bbox": bbox, "size": 1000},
+            {"bbox": bbox, "grid": "hexagon", "size": 500},
+            {"bbox": bbox, "grid": "kmeans", "clusters": 2},
+        ):
+            response = test_client.post("/api/solutions/aggregate", json=body)
+            assert response.status_code == 200, response.text
+            cells = response.json()
+            assert [cell["count"] for cell in cells] == [TEST_SOLUTIONS // 2] * 2
+            for cell in cells:
+                assert cell["targets"]["Heat"] == {
+                    "mean": 50,
+                    "max": 50,
+                    "count": TEST_SOLUTIONS // 2,
+                }
+                assert shape(cell["geometry"]).is_valid
+            west, east = sorted(shape(cell["geometry"]).centroid.x for cell in cells)
+            assert west < 0.01 < east
+        body = {"bbox": bbox, "size": 1000, "targets": [{**HEAT, "value": 60}]}
+        response = test_client.post("/api/solutions/aggregate", json=body)
+        assert response.json() == []
+
+
+def test_nearest(postgis):
+    # at 70 degrees north, solution 1 is 19 km east of the point, and the rest are over
+    # 22 km north, but nearer in degrees. Solution 3 is across the antimeridian
+    execute_sql(
+        "UPDATE naturebasedsolution SET geometry = ST_SetSRID(ST_MakePoint("
+        "CASE id WHEN 1 THEN 0.5 WHEN 3 THEN -179.999 ELSE 0 END, "
+        "CASE id WHEN 1 THEN 70 WHEN 3 THEN 0 ELSE 70.2 + id * 0.01 END), 4326)"
+    )
+    with TestClient(app) as test_client:
+        for body, expected in (
+            ({"point": [0, 70], "limit": 1}, [1]),
+            ({"point": [0, 70], "limit": 2}, [1, 2]),
+            ({"point": [0, 70], "limit": 1, "max_distance": 20_000}, [1]),
+            ({"point": [0, 70], "limit": 1, "max_distance": 10_000}, []),
+            ({"point": [179.999, 0], "limit": 1}, [3]),
+            ({"point": [179.999, 0], "limit": 1, "max_distance": 1000}, [3]),
+        ):
+            response = test_client.post("/api/solutions/nearest", json=body)
+            assert response.status_code == 200, response.text
+            solutions = response.json()
+            assert [solution["id"] for solution in solutions] == expected, body
+            if expected == [1]:
+                assert 18_000 < solutions[0]["distance"] < 20_000
+            elif expected == [3]:
+                assert solutions[0]["distance"] < 250
+
+
+def test_statement_budgets(database):
+    """
+    Fail when a route runs more SQL statements, or fetches more rows, than it should.
+    Each route is requested once to warm up before it's counted, and response caches
+    are cleared
+    """
+    with TestClient(app) as test_client:
+        for method, path, body, max_statements, max_rows in STATEMENT_BUDGETS:
+            for warm_up in (True, False):
+                delete_new_solution()
+                invalidate_solution_caches()
+                with StatementCounter(sessionmanager._engine) as counter:
+                    response = test_client.request(method, path, json=body)
+                assert response.status_code == 200, response.text
+                if not warm_up:
+                    assert counter.statements <= max_statements, (method, path)
+                    assert counter.rows <= max_rows, (method, path)
+
+
+def test_profiling(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profile_log", str(tmp_path / "profile.log"))
+    monkeypatch.setattr(profiling.logger, "handlers", [])
+
+    async def endpoint(scope, receive, send):
+        with phase("serialise"):
+            profile = current_profile.get()
+        if profile is not None:
+            profile.statements.append(
+                profiling.Statement(
+                    sql="SELECT 1",
+                    parameters=profiling.format_parameters({"wkb": b"\x00" * 500}),
+                    operation="get_things",
+                    seconds=0.002,
+                    rows=1,
+                    plan="Result  (actual time=0.001..0.001 rows=1 loops=1)",
+                )
+            )
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    profiled = TestClient(profiling.ProfilingMiddleware(endpoint))
+    assert "x-profile-id" not in profiled.get("/things").headers
+    # requests must send the shared secret, and nothing is profiled without one
+    assert (
+        "x-profile-id"
+        not in profiled.get("/things", headers={"X-Profile": "1"}).headers
+    )
+    monkeypatch.setattr(settings, "profile_token", "s3cret")
+    assert (
+        "x-profile-id"
+        not in profiled.get("/things", headers={"X-Profile": "1"}).headers
+    )
+    response = profiled.get("/things", headers={"X-Profile": "s3cret"})
+    profiling.logger.handlers[0].flush()
+    log = (tmp_path / "profile.log").read_text()
+    assert f"=== {response.headers['x-profile-id']} GET /things 200" in log
+    assert "1 statements" in log
+    assert "phase serialise" in log
+    assert "--- statement 1 (get_things)" in log
+    assert "(500 characters)" not in log and "characters)" in log
+    assert "--- cProfile" in log
+    assert current_profile.get() is None
+
+
+def test_profiled_statements():
+    engine = create_engine("postgresql+psycopg://")
+    profiling.instrument_engine(engine)
+    cursor = MagicMock(rowcount=1)
+    explain_cursor = MagicMock()
+    explain_cursor.fetchall.return_value = [("Seq Scan on naturebasedsolution",)]
+    conn = MagicMock()
+    conn.connection.dbapi_connection.cursor.return_value = explain_cursor
+    # standing in for the driver's base exception, e.g. psycopg.Error
+    conn.dialect.loaded_dbapi.Error = LookupError
+    profile = profiling.Profile(method="GET", path="/things")
+    token = current_profile.set(profile)
+    try:
+        for statement, parameters, write in (
+            ("SELECT * FROM naturebasedsolution WHERE id = %(id)s", {"id": 1}, False),
+            (
+                "INSERT INTO naturebasedsolution (name) VALUES (%(name)s)",
+                {"name": "a"},
+                True,
+            ),
+        ):
+            context = MagicMock(
+                isinsert=write, isupdate=False, isdelete=False, execution_options={}
+            )
+            explain_cursor.reset_mock()
+            engine.dispatch.before_cursor_execute(
+                conn, cursor, statement, parameters, context, False
+            )
+            engine.dispatch.after_cursor_execute(
+                conn, cursor, statement, parameters, context, False
+            )
+            # statements are explained in a savepoint which is rolled back, and writes
+            # aren't run again
+            options = "BUFFERS" if write else "ANALYZE, BUFFERS"
+            assert explain_cursor.execute.call_args_list == [
+                call("SAVEPOINT nbsapi_profile"),
+                call(f"EXPLAIN ({options}) {statement}", parameters),
+                call("ROLLBACK TO SAVEPOINT nbsapi_profile"),
+            ]
+            explain_cursor.close.assert_called_once()
+        # failures are reported in the plan, after the savepoint is rolled back
+        explain_cursor.reset_mock()
+        error = DBAPIError("EXPLAIN SELEC", {}, Exception("syntax error"))
+        explain_cursor.execute.side_effect = [None, error, None]
+        plan = profiling.explain(conn.connection.dbapi_connection, "SELEC", {}, True)
+        assert plan.startswith("EXPLAIN failed:") and "syntax error" in plan
+        assert explain_cursor.execute.call_args_list[-1] == call(
+            "ROLLBACK TO SAVEPOINT nbsapi_profile"
+        )
+        # other errors aren't hidden
+        explain_cursor.execute.side_effect = [None, RuntimeError("bug"), None]
+        with pytest.raises(RuntimeError):
+            profiling.explain(conn.connection.dbapi_connection, "SELECT 1", {}, True)
+        # the driver's own errors are reported too
+        explain_cursor.execute.side_effect = [None, LookupError("can't plan"), None]
+        engine.dispatch.before_cursor_execute(
+            conn, cursor, "COMMIT", {}, context, False
+        )
+        engine.dispatch.after_cursor_execute(conn, cursor, "COMMIT", {}, context, False)
+        # executemany isn't explained
+        engine.dispatch.before_cursor_execute(conn, cursor, "INSERT", [], context, True)
+        engine.dispatch.after_cursor_execute(conn, cursor, "INSERT", [], context, True)
+    finally:
+        current_profile.reset(token)
+    assert [statement.plan for statement in profile.statements] == [
+        "Seq Scan on naturebasedsolution",
+        "Seq Scan on naturebasedsolution",
+        "EXPLAIN failed: can't plan",
+        "(executemany: not explained)",
+    ]
+    assert profile.statements[1].rows == 1
+
+
+def test_statement_tracer(monkeypatch):
+    assert fingerprint(
+        "SELECT x FROM t\n WHERE id IN (%(id_1)s::INTEGER, %(id_2)s::INTEGER)"
+        " AND name = 'a''b' AND value >= %(value_1)s::INTEGER AND v2 >= 10"
+    ) == ("SELECT x FROM t WHERE id IN (...) AND name = ? AND value >= ? AND v2 >= ?")
+    tracer = StatementTracer(slow_ms=50, sample_rate=0, capacity=2)
+    tracer.record("SELECT 1", 0.01, 1, "fast")
+    for value in (2, 3, 4):
+        tracer.record(f"SELECT {value}", 0.1, 1, "slow")
+    # the ring buffer keeps the last two
+    report = tracer.report(limit=10)
+    assert [traced["milliseconds"] for traced in report["slow"]] == [100, 100]
+    assert report["sampled"] == []
+    [offender] = report["offenders"]
+    assert offender["fingerprint"] == "SELECT ?"
+    assert offender["count"] == 2 and offender["routes"] == ["unmatched"]
+    tracer = StatementTracer(slow_ms=0, sample_rate=1, capacity=10)
+    tracer.record("SELECT 1", 0.01, 1, "fast")
+    assert len(tracer.sampled) == 1 and not tracer.slow
+
+    # admin routes don't exist without a token, and need it when they do
+    assert client.get("/admin/statements").status_code == 404
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    assert client.get("/admin/statements").status_code == 403
+    headers = {"X-Admin-Token": "wrong"}
+    assert client.get("/admin/statements", headers=headers).status_code == 403
+    headers = {"X-Admin-Token": "secret"}
+    assert client.get("/admin/statements", headers=headers).status_code == 404
+    monkeypatch.setattr(sessionmanager, "tracer", tracer)
+    response = client.get("/admin/statements", headers=headers)
+    assert response.json()["sampled"][0]["operation"] == "fast"
+
+
+def test_statement_context_without_metrics(monkeypatch):
+    """Statements are attributed to their route and operation with metrics disabled"""
+    monkeypatch.setattr(settings, "metrics_enabled", False)
+
+    @instrumented
+    async def operation():
+        return route_name(), current_operation.get()
+
+    context_app = FastAPI()
+    context_app.add_middleware(RequestContextMiddleware)
+
+    @context_app.get("/things/{thing_id}")
+    async def read_thing(thing_id: int):
+        return await operation()
+
+    response = TestClient(context_app).get("/things/1")
+    assert response.json() == ["/things/{thing_id}", operation.__qualname__]
+
+
+def test_closed_session_manager():
+    manager = DatabaseSessionManager("postgresql+psycopg://nbsapi@localhost/nbsapi")
+
+    async def exercise():
+        # the engine is created on first use
+        async with manager.session():
+            assert manager._engine is not None
+        await manager.close()
+        # but not again once it's been closed, since nothing would dispose of it
+        with pytest.raises(Exception, match="closed"):
+            async with manager.session():
+                pass
+        with pytest.raises(Exception, match="closed"):
+            async with manager.connect():
+                pass
+        assert manager._engine is None
+        # until the app starts again
+        manager.init()
+        async with manager.session():
+            pass
+        await manager.close()
+
+    asyncio.run(exercise())
+
+
+def test_shutdown_while_warming_up():
+    events = []
+
+    async def warm_up():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+
+    manager = MagicMock(close=AsyncMock(side_effect=lambda: events.append("closed")))
+    with (
+        patch("nbsapi.main.warm_up", warm_up),
+        patch("nbsapi.main.sessionmanager", manager),
+    ):
+        with TestClient(app):
+            pass
+    # the warm-up task has stopped before the engine is closed
+    assert events == ["cancelled", "closed"]
+
+
+def test_import_time():
+    """
+    Importing the app doesn't create the engine, connect, or load the geo or optional
+    libraries, and fits in a budget.
+    The budget allows for slow CI machines: it's there to catch large new import-time
+    costs
+    """
+    modules = (*LAZY_IMPORTS, "psycopg")
+    script = (
+        "import sys\n"
+        "import nbsapi.main\n"
+        "from nbsapi.database import sessionmanager\n"
+        "assert sessionmanager._engine is None\n"
+        f"print(' '.join(m for m in {modules!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == ""
+    [main] = [
+        line for line in result.stderr.splitlines() if line.endswith("| nbsapi.main")
+    ]
+    cumulative_us = int(main.split("|")[1])
+    assert cumulative_us / 1_000_000 < IMPORT_TIME_BUDGET